@@ -1 +1,40 @@
-from scraper.telegraphscrape import *
\ No newline at end of file
+import importlib
+import sys
+
+# public names of the scraper module that are available from the package
+SCRAPER_NAMES = ('LOG_FILE', 'Scraper', 'buildFilters', 'deleteEmptyFolders', 'parser', 'printSummary', 'progressBar',
+                 'runArgs', 'runBatch', 'runPooledQuery', 'runQuery', 'setupLogging')
+
+
+def main():
+    '''
+    Entry point of the telegraph-scraper command. Only the modules of the selected command are imported,
+    so the search command and daemon clients start without the HTTP stack. A query named "search" or "serve"
+    is scraped when it follows "--", ex. telegraph-scraper --text -- search
+    :params: none
+    :return: exit status
+    '''
+    argv = sys.argv[1:]
+    if argv[:1] == ['search']:
+        from .search import main as search
+        return search(argv[1:])
+    if argv[:1] == ['serve']:
+        from .daemon import main as serve
+        return serve(argv[1:])
+
+    from .daemon import request, socketArgument
+    path = socketArgument(argv)
+    if path:
+        return request(path, argv)
+
+    from .telegraphscrape import main as scrape
+    return scrape(argv)
+
+
+def __getattr__(name):
+    # names of the scraper module, ex. scraper.Scraper, are loaded on first access. Other names are not looked up
+    # there, so "from . import extra" inside a module imported by the scraper module still finds the submodule
+    if name not in SCRAPER_NAMES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module = importlib.import_module('.telegraphscrape', __name__)
+    return getattr(module, name)
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import time
+
+from .metrics import metrics, requestOutcome
+from .transport import DNS_TTL
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class AsyncIndexer(object):
+    '''
+    Asyncio indexing engine for Scraper.indexQuery. Keeps a bounded number of
+    getPage requests in flight over keep-alive connections and probes several
+    page indexes of the same date at once (speculative look-ahead)
+    '''
+    def __init__(self, scraper, concurrency, per_host=None, lookahead=4, content=True):
+        if aiohttp is None:
+            raise RuntimeError('The async engine requires aiohttp: pip install "telegraph-scraper[async]"')
+        self.scraper = scraper
+        self.concurrency = max(1, concurrency)
+        self.per_host = per_host or self.concurrency
+        self.lookahead = max(1, lookahead)
+        self.content = content
+
+    def run(self, dates):
+        '''
+        Indexes all given dates, handing found pages to Scraper.addPage as they arrive
+        :params: dates (list) - datetime objects to probe
+        :return: number of found pages
+        '''
+        return asyncio.run(self.indexDates(dates))
+
+    async def indexDates(self, dates):
+        '''
+        Opens a pooled session and indexes every date concurrently
+        :params: dates (list) - datetime objects to probe
+        :return: number of found pages
+        '''
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(
+            limit=self.concurrency,
+            limit_per_host=self.per_host,
+            keepalive_timeout=30,
+            ttl_dns_cache=DNS_TTL,
+        )
+        async with aiohttp.ClientSession(connector=connector, headers=self.scraper.headers) as session:
+            self.session = session
+            results = await asyncio.gather(*(self.indexDate(date) for date in dates))
+        return sum(results)
+
+    async def indexDate(self, date):
+        '''
+        Probes <query>-MM-DD-N from the index after the date's high-water mark in windows of
+        `lookahead` requests until the first miss. Results past the first miss are thrown away
+        :params: date (datetime) - the date to probe
+        :return: number of found pages
+        '''
+        formatted_date = date.strftime('%m-%d')
+        pages = 0
+        index = self.scraper.marks.get(formatted_date, 0) + 1
+        while True:
+            window = range(index, index + self.lookahead)
+            results = await asyncio.gather(*(self.probe(formatted_date, i) for i in window))
+            for data in results:
+                if not data or not data.get('ok'):
+                    # a miss, or a slug that kept failing: the next run resumes from the high-water mark
+                    if data is not None:
+                        self.scraper.misses[self.scraper.slug(formatted_date, index)] = time.time()
+                    self.scraper.outer_pbar.update()
+                    return pages
+                self.scraper.addPage(data)
+                pages += 1
+                self.scraper.marks[formatted_date] = index
+                index += 1
+
+    async def probe(self, formatted_date, index):
+        '''
+        Fetches a single page index of a date
+        :params: formatted_date (str) - MM-DD; index (int) - page index, 1 for the unsuffixed slug
+        :return: JSON response from the API or None when all attempts failed
+        '''
+        search_query = self.scraper.slug(formatted_date, index)
+
+        limiter = self.scraper.limiter
+        for attempt in range(limiter.max_attempts):
+            status, data, retry_after = None, None, None
+            async with self.semaphore:
+                await limiter.acquireAsync()
+                started = time.monotonic()
+                try:
+                    async with self.session.get(self.scraper.pageUrl(search_query, self.content)) as response:
+                        status, retry_after = response.status, response.headers.get('Retry-After')
+                        data = await response.json(content_type=None)
+                except Exception as ex:
+                    logging.error(f'Error while processing {search_query}: {ex}')
+                finally:
+                    latency = time.monotonic() - started
+                    limiter.release(status, latency)
+                    outcome = requestOutcome(status, data)
+                    metrics.inc('api_requests_total', outcome=outcome)
+                    metrics.observe('api_request_seconds', latency, outcome=outcome)
+
+            delay = limiter.retryDelay(attempt, status, data, retry_after)
+            if delay is None:
+                return data
+            await asyncio.sleep(delay)
+
+        logging.error(f'Giving up on {search_query} after {limiter.max_attempts} attempts')
+        return None
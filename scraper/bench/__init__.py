@@ -0,0 +1 @@
+from .mockserver import MockTelegraph
@@ -0,0 +1,4 @@
+from .scenarios import main
+
+if __name__ == '__main__':
+    main()
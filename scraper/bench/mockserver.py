@@ -0,0 +1,234 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class MockTelegraph(object):
+    '''
+    Local stand-in for api.telegra.ph/getPage and telegra.ph/file/* with configurable latency,
+    pages per date, image sizes and throttling. Every <query>-MM-DD date is either empty or holds
+    `pages_per_date` pages, decided by a seeded random generator so runs are reproducible
+    '''
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, pages_per_date=3, empty_ratio=0.5,
+                 images_per_page=3, image_size=100 * 1024, paragraphs=5, rate=None, seed=0):
+        self.latency = latency
+        self.pages_per_date = pages_per_date
+        self.empty_ratio = empty_ratio
+        self.images_per_page = images_per_page
+        self.image_size = image_size
+        self.paragraphs = paragraphs
+        self.rate = rate
+        self.seed = seed
+        self.image_body = random.Random(seed).getrandbits(8 * image_size).to_bytes(image_size, 'little') if image_size else b''
+        self.lock = threading.Lock()
+        self.tokens = rate or 0
+        self.updated = time.monotonic()
+        self.reset()
+
+        handler = type('Handler', (MockHandler,), {'mock': self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.url = f'http://{host}:{self.server.server_address[1]}'
+        self.thread = None
+
+    def start(self):
+        '''
+        Serves requests on a background thread
+        :params: none
+        :return: base URL of the server
+        '''
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self):
+        '''
+        Clears request counters and latency samples
+        :params: none
+        :return: none
+        '''
+        with self.lock:
+            self.requests = 0
+            self.throttled = 0
+            self.bytes_sent = 0
+            self.latencies = []
+
+    def stats(self):
+        '''
+        Summarizes the requests served since the last reset
+        :params: none
+        :return: dict with requests, throttled, bytes and p50/p99 latency in milliseconds
+        '''
+        with self.lock:
+            latencies = sorted(self.latencies)
+            return {
+                'requests': self.requests,
+                'throttled': self.throttled,
+                'bytes': self.bytes_sent,
+                'latency_p50_ms': percentile(latencies, 50) * 1000,
+                'latency_p99_ms': percentile(latencies, 99) * 1000,
+            }
+
+    def record(self, started, size, throttled=False):
+        with self.lock:
+            self.requests += 1
+            self.throttled += throttled
+            self.bytes_sent += size
+            self.latencies.append(time.monotonic() - started)
+
+    def allow(self):
+        '''
+        Token bucket deciding whether a request is served or throttled
+        :params: none
+        :return: bool
+        '''
+        if not self.rate:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def pagesOn(self, date):
+        '''
+        Number of pages published on a MM-DD date
+        :params: date (str) - MM-DD
+        :return: int
+        '''
+        rng = random.Random(f'{self.seed}-{date}')
+        return 0 if rng.random() < self.empty_ratio else self.pages_per_date
+
+    def page(self, slug, content):
+        '''
+        Builds the getPage response for a slug
+        :params: slug (str) - page path; content (bool) - include the node tree
+        :return: dict response
+        '''
+        match = re.match(r'^(.+)-(\d{2}-\d{2})(?:-(\d+))?$', slug)
+        if not match or int(match.group(3) or 1) > self.pagesOn(match.group(2)):
+            return {'ok': False, 'error': 'PAGE_NOT_FOUND'}
+        index = int(match.group(3) or 1)
+        result = {
+            'path': slug,
+            'url': f'https://telegra.ph/{slug}',
+            'title': f'{match.group(1)} {match.group(2)} #{index}',
+            'description': '',
+            'author_name': 'mock',
+            'views': index * 10,
+            'can_edit': False,
+        }
+        if content:
+            nodes = []
+            for i in range(self.paragraphs):
+                nodes.append({'tag': 'p', 'children': [
+                    f'Paragraph {i} of {slug}. ',
+                    {'tag': 'b', 'children': ['bold text ']},
+                    {'tag': 'a', 'attrs': {'href': f'https://example.com/{slug}/{i}'}, 'children': ['a link']},
+                ]})
+            for i in range(self.images_per_page):
+                nodes.append({'tag': 'figure', 'children': [
+                    {'tag': 'img', 'attrs': {'src': f'/file/{slug}-{i}.jpg'}},
+                    {'tag': 'figcaption', 'children': [f'image {i}']},
+                ]})
+            result['content'] = nodes
+        return {'ok': True, 'result': result}
+
+    def image(self, name):
+        '''
+        Builds a unique image body for a file name
+        :params: name (str) - file name
+        :return: (bytes, etag)
+        '''
+        digest = hashlib.sha256(name.encode('utf-8')).digest()
+        return digest + self.image_body[len(digest):], f'"{digest.hex()[:16]}"'
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body leave in one write, and without Nagle's algorithm, so keep-alive requests
+    # do not wait for the client's delayed ACK (about 40 ms on Linux)
+    wbufsize = -1
+    disable_nagle_algorithm = True
+    mock = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        started = time.monotonic()
+        url = urlparse(self.path)
+        if url.path == '/_stats':
+            return self.send(200, json.dumps(self.mock.stats()).encode(), 'application/json')
+        if url.path == '/_reset':
+            self.mock.reset()
+            return self.send(200, b'{}', 'application/json')
+
+        if self.mock.latency:
+            time.sleep(self.mock.latency)
+        if not self.mock.allow():
+            self.send(429, b'{"ok":false,"error":"Too Many Requests"}', 'application/json', {'Retry-After': '1'})
+            return self.mock.record(started, 0, throttled=True)
+
+        if url.path.startswith('/getPage/'):
+            content = parse_qs(url.query).get('return_content', ['false'])[0] == 'true'
+            body = json.dumps(self.mock.page(url.path[len('/getPage/'):], content)).encode()
+            self.send(200, body, 'application/json')
+        elif url.path.startswith('/file/'):
+            body = self.sendImage(url.path[len('/file/'):])
+        else:
+            body = b'{"ok":false,"error":"METHOD_NOT_FOUND"}'
+            self.send(404, body, 'application/json')
+        self.mock.record(started, len(body))
+
+    def sendImage(self, name):
+        body, etag = self.mock.image(name)
+        if self.headers.get('If-None-Match') == etag:
+            self.send(304, b'', 'image/jpeg', {'ETag': etag})
+            return b''
+        byte_range = re.match(r'bytes=(\d+)-$', self.headers.get('Range', ''))
+        if byte_range:
+            start = int(byte_range.group(1))
+            if start >= len(body):
+                self.send(416, b'', 'image/jpeg', {'Content-Range': f'bytes */{len(body)}'})
+                return b''
+            self.send(206, body[start:], 'image/jpeg',
+                      {'ETag': etag, 'Content-Range': f'bytes {start}-{len(body) - 1}/{len(body)}'})
+            return body[start:]
+        self.send(200, body, 'image/jpeg', {'ETag': etag})
+        return body
+
+    def send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.wfile.flush()
+
+
+def percentile(values, p):
+    '''
+    Nearest-rank percentile of sorted values
+    :params: values (list) - sorted numbers; p (float) - percentile, 0-100
+    :return: float, 0.0 for an empty list
+    '''
+    if not values:
+        return 0.0
+    rank = max(0, min(len(values) - 1, int(round(p / 100 * len(values) + 0.5)) - 1))
+    return values[rank]
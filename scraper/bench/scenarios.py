@@ -0,0 +1,246 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from datetime import datetime
+
+from .mockserver import MockTelegraph, percentile
+
+SCENARIOS = ['index-thread', 'index-async', 'content', 'cache-save', 'cache-load', 'filter', 'text', 'images']
+QUERY = 'bench'
+
+
+def newScraper(workdir, store, progress=False):
+    '''
+    Creates a scraper whose page store, blob store and outputs live in the benchmark work directory
+    :params: workdir (str) - benchmark work directory; store (str) - page store file name
+    :return: Scraper
+    '''
+    from ..telegraphscrape import Scraper
+
+    scraper = Scraper(QUERY, os.path.join(workdir, 'output'), progress)
+    scraper.cache_path = os.path.join(workdir, store)
+    scraper.legacy_cache_path = os.path.join(workdir, 'legacy')
+    scraper.blobs_path = os.path.join(workdir, 'blobs')
+    return scraper
+
+
+def copyStore(workdir, source, target):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(os.path.join(workdir, source + suffix)):
+            shutil.copyfile(os.path.join(workdir, source + suffix), os.path.join(workdir, target + suffix))
+
+
+def runScenario(name, url, workdir, workers, results):
+    '''
+    Runs one scenario in a fresh process: untimed preparation, then the timed stage
+    bracketed by mock server counter resets. Latency is reported as seen by the server and by the client
+    :params: name (str) - scenario name; url (str) - mock server base URL; workdir (str) - benchmark work directory;
+             workers (int) - scraper workers; results (multiprocessing.Queue) - receives the scenario result
+    :return: none
+    '''
+    from ..metrics import bucketQuantile, metrics
+    from ..telegraphscrape import Scraper, setupLogging
+    from ..store import PageList, PageStore
+    from ..transport import Transport
+
+    setupLogging(os.path.join(workdir, f'{name}.log'))
+    Scraper.api_url = url
+    Scraper.file_url = f'{url}/file/'
+    # time from sending a request to parsing its response headers, for every request of the shared session
+    samples = []
+    Transport.shared().session.hooks['response'].append(
+        lambda response, *args, **kwargs: samples.append(response.elapsed.total_seconds()))
+
+    def timed(stage):
+        urllib.request.urlopen(f'{url}/_reset').read()
+        samples.clear()
+        metrics.reset()
+        started = time.perf_counter()
+        pages = stage()
+        seconds = time.perf_counter() - started
+        stats = json.load(urllib.request.urlopen(f'{url}/_stats'))
+        if samples:
+            latencies = sorted(samples)
+            client = {'client_p50_ms': percentile(latencies, 50) * 1000, 'client_p99_ms': percentile(latencies, 99) * 1000}
+        else:
+            # the async engine does not use the requests session, its API latency histogram is bucketed
+            histograms = [h for (key, labels), h in metrics.snapshot()['histograms'].items() if key == 'api_request_seconds']
+            histogram = {'buckets': [sum(counts) for counts in zip(*(h['buckets'] for h in histograms))],
+                         'count': sum(h['count'] for h in histograms)}
+            quantiles = [bucketQuantile(histogram, q) for q in (0.5, 0.99)]
+            client = {'client_p50_ms': (quantiles[0] or 0) * 1000, 'client_p99_ms': (quantiles[1] or 0) * 1000}
+        return dict(stats, **client, seconds=seconds, pages=pages)
+
+    try:
+        if name in ('index-thread', 'index-async'):
+            store = 'index.sqlite' if name == 'index-thread' else 'index-async.sqlite'
+            scraper = newScraper(workdir, store)
+            scraper.getCache()
+            result = timed(lambda: scraper.indexQuery(workers, name.split('-')[1], content=False) or len(scraper.pagelist))
+            scraper.updateCache()
+        elif name == 'content':
+            copyStore(workdir, 'index.sqlite', 'content.sqlite')
+            scraper = newScraper(workdir, 'content.sqlite')
+            scraper.getCache()
+            result = timed(lambda: scraper.fetchContent(workers) or len(scraper.pagelist))
+        elif name == 'cache-save':
+            source = PageStore(os.path.join(workdir, 'content.sqlite'))
+            pages = [source.get(path) for path in source.paths()]
+            source.close()
+            scraper = newScraper(workdir, 'save.sqlite')
+            scraper.getCache()
+            scraper.pagelist = PageList(scraper.cache, pages)
+            result = timed(lambda: scraper.updateCache() or len(pages))
+        else:
+            copyStore(workdir, 'content.sqlite', f'{name}.sqlite')
+            scraper = newScraper(workdir, f'{name}.sqlite')
+            if name == 'cache-load':
+                result = timed(lambda: scraper.getCache() or sum(1 for _ in scraper.pagelist))
+            else:
+                scraper.getCache()
+                stage = {
+                    'filter': lambda: scraper.filterText(1, None),
+                    'text': scraper.getText,
+                    'images': lambda: scraper.getImages(workers),
+                }[name]
+                result = timed(lambda: stage() or len(scraper.pagelist))
+        result['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        results.put((name, result))
+    except Exception as ex:
+        results.put((name, {'error': repr(ex)}))
+
+
+def summarize(result):
+    '''
+    Adds throughput figures to a raw scenario result
+    :params: result (dict) - output of runScenario
+    :return: dict
+    '''
+    if 'error' in result:
+        return result
+    seconds = result['seconds'] or 1e-9
+    return {
+        'seconds': round(seconds, 4),
+        'requests': result['requests'],
+        'throttled': result['throttled'],
+        'requests_per_sec': round(result['requests'] / seconds, 2),
+        'pages': result['pages'],
+        'pages_per_sec': round(result['pages'] / seconds, 2),
+        'mb': round(result['bytes'] / 2 ** 20, 3),
+        'mb_per_sec': round(result['bytes'] / 2 ** 20 / seconds, 3),
+        'latency_p50_ms': round(result['latency_p50_ms'], 2),
+        'latency_p99_ms': round(result['latency_p99_ms'], 2),
+        'client_p50_ms': round(result['client_p50_ms'], 2),
+        'client_p99_ms': round(result['client_p99_ms'], 2),
+        'peak_rss_mb': round(result['peak_rss_mb'], 1),
+    }
+
+
+def measureStartup(runs):
+    '''
+    Times start-up in fresh interpreters: a bare interpreter, the import of the scraper module alone,
+    and the whole `telegraph-scraper --help` command
+    :params: runs (int) - runs of each measurement, the median is reported
+    :return: dict of milliseconds
+    '''
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get('PYTHONPATH')])))
+    measure = 'import time; started = time.perf_counter(); import scraper.telegraphscrape; print(time.perf_counter() - started)'
+    commands = {
+        'interpreter_ms': [sys.executable, '-c', 'pass'],
+        'help_ms': [sys.executable, '-m', 'scraper', '--help'],
+    }
+    startup = {name: [] for name in ['import_ms'] + list(commands)}
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', measure], env=env, check=True, capture_output=True, text=True).stdout
+        startup['import_ms'].append(float(output) * 1000)
+        for name, command in commands.items():
+            started = time.perf_counter()
+            subprocess.run(command, env=env, check=True, stdout=subprocess.DEVNULL)
+            startup[name].append((time.perf_counter() - started) * 1000)
+    return {name: round(statistics.median(values), 1) for name, values in startup.items()}
+
+
+def parser():
+    '''
+    Returns the benchmark parser arguments
+    :params: none
+    :return: parser.parse_args() object
+    '''
+    parser = argparse.ArgumentParser(description='Benchmarks telegraph-scraper stages against a local mock Telegraph server')
+    parser.add_argument('-s', '--scenarios', help=f'comma separated scenarios (default all: {",".join(SCENARIOS)})',
+                        default=','.join(SCENARIOS))
+    parser.add_argument('-w', '--workers', help='scraper workers (default 16)', type=int, default=16)
+    parser.add_argument('--latency', help='mock response latency in seconds (default 0.02)', type=float, default=0.02)
+    parser.add_argument('--pages-per-date', help='pages on every non-empty date (default 3)', type=int, default=3)
+    parser.add_argument('--empty-ratio', help='share of dates without pages (default 0.5)', type=float, default=0.5)
+    parser.add_argument('--images-per-page', help='images on every page (default 3)', type=int, default=3)
+    parser.add_argument('--image-size', help='image size in bytes (default 102400)', type=int, default=100 * 1024)
+    parser.add_argument('--rate', help='mock requests per second before answering 429 (default unlimited)', type=float)
+    parser.add_argument('--seed', help='random seed of the mock (default 0)', type=int, default=0)
+    parser.add_argument('--startup-runs', help='fresh interpreters timed for start-up and import time, 0 to skip (default 5)',
+                        type=int, default=5)
+    parser.add_argument('-o', '--output', help='JSON results file (default "bench.json")', default='bench.json')
+    return parser.parse_args()
+
+
+def main():
+    args = parser()
+    names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        sys.exit(f'Unknown scenarios: {", ".join(sorted(unknown))}')
+
+    mock = MockTelegraph(latency=args.latency, pages_per_date=args.pages_per_date, empty_ratio=args.empty_ratio,
+                         images_per_page=args.images_per_page, image_size=args.image_size, rate=args.rate, seed=args.seed)
+    url = mock.start()
+    workdir = tempfile.mkdtemp(prefix='telegraph-bench-')
+    # later scenarios start from the stores written by the index and content scenarios
+    required = {'content': ['index-thread'], 'cache-save': ['index-thread', 'content']}
+    for name in ('cache-load', 'filter', 'text', 'images'):
+        required[name] = ['index-thread', 'content']
+
+    startup = measureStartup(args.startup_runs) if args.startup_runs > 0 else {}
+    if startup:
+        print(f'{"startup":>13}: {json.dumps(startup)}')
+
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    report = {}
+    try:
+        for name in SCENARIOS:
+            if name not in names and not any(name in required.get(wanted, []) for wanted in names):
+                continue
+            process = context.Process(target=runScenario, args=(name, url, workdir, args.workers, results))
+            process.start()
+            process.join()
+            name, result = results.get()
+            if name in names:
+                report[name] = summarize(result)
+                print(f'{name:>13}: {json.dumps(report[name])}')
+    finally:
+        mock.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': vars(args),
+        'startup': startup,
+        'scenarios': report,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(output, f, indent=4)
+    print(f'Results written to {args.output}')
@@ -0,0 +1,235 @@
+import hashlib
+import logging
+import mimetypes
+import os
+import sqlite3
+import threading
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    # file locks are not available on Windows
+    fcntl = None
+
+EXTENSIONS = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/gif': '.gif',
+    'image/webp': '.webp',
+    'video/mp4': '.mp4',
+}
+
+
+class BlobStore(object):
+    '''
+    Content-addressed store for downloaded files shared by all pages, queries and runs.
+    Blobs are named by the SHA-256 of their content; an index maps Telegraph file ids to blobs
+    so a known file is never downloaded again
+    '''
+    def __init__(self, root):
+        self.root = root
+        self.temp_dir = os.path.join(root, 'tmp')
+        if not os.path.exists(self.temp_dir):
+            os.makedirs(self.temp_dir)
+        self.lock = threading.Lock()
+        # blobs hashed by this instance, each one is verified at most once per run
+        self.verified = set()
+        self.verify_locks = {}
+        self.connection = sqlite3.connect(os.path.join(root, 'index.sqlite'), timeout=30,
+                                          check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS files (
+                id TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                ext TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                etag TEXT,
+                last_modified TEXT
+            )
+        ''')
+        columns = {row[1] for row in self.connection.execute('PRAGMA table_info(files)')}
+        for column in ('etag', 'last_modified'):
+            if column not in columns:
+                self.connection.execute(f'ALTER TABLE files ADD COLUMN {column} TEXT')
+
+    def blobPath(self, sha256, ext):
+        return os.path.join(self.root, sha256[:2], sha256 + ext)
+
+    def lookup(self, file_id):
+        '''
+        Finds the blob of a Telegraph file without any network I/O. A blob is checked against its SHA-256
+        the first time it is reused in a run, so a corrupted blob is downloaded again instead of being linked
+        :params: file_id (str) - file id returned by fileId()
+        :return: dict with the blob 'path', 'size', 'etag' and 'last_modified', or None if the file
+                 is unknown or its blob is missing or corrupted
+        '''
+        with self.lock:
+            row = self.connection.execute('SELECT sha256, ext, size, etag, last_modified FROM files WHERE id = ?',
+                                          (file_id,)).fetchone()
+        if row is None:
+            return None
+        path = self.blobPath(row[0], row[1])
+        if not os.path.exists(path) or os.path.getsize(path) != row[2] or not self.isIntact(path):
+            return None
+        return {'path': path, 'size': row[2], 'etag': row[3], 'last_modified': row[4]}
+
+    def tempPath(self, file_id=None):
+        '''
+        Returns the path for a download in progress, on the same filesystem as the blobs. The path of a file is
+        stable so an interrupted download can be resumed, and has to be claimed first (see claim)
+        :params: file_id (str, optional) - file id returned by fileId(), without it the path is unique to one download
+        :return: file path
+        '''
+        if file_id is None:
+            return os.path.join(self.temp_dir, uuid.uuid4().hex + '.part')
+        return os.path.join(self.temp_dir, hashlib.sha256(file_id.encode('utf-8')).hexdigest()[:32] + '.part')
+
+    def claim(self, file_id):
+        '''
+        Claims the partial download of a file, waiting while another process holds it, so only one process
+        writes or resumes it at a time. The claim is a lock on a file next to the partial download, which
+        the operating system releases if the process dies
+        :params: file_id (str) - file id returned by fileId()
+        :return: open lock file to pass to release(), or None on platforms without file locks
+        '''
+        if fcntl is None:
+            return None
+        path = self.tempPath(file_id) + '.lock'
+        while True:
+            claim = open(path, 'ab')
+            fcntl.flock(claim, fcntl.LOCK_EX)
+            try:
+                # the previous holder removes the lock file on release, a lock on a removed file claims nothing
+                if os.fstat(claim.fileno()).st_ino == os.stat(path).st_ino:
+                    return claim
+            except FileNotFoundError:
+                pass
+            claim.close()
+
+    def release(self, claim):
+        '''
+        Releases a claim returned by claim()
+        :params: claim (file) - open lock file
+        :return: none
+        '''
+        os.remove(claim.name)
+        claim.close()
+
+    def add(self, file_id, temp_path, sha256, content_type=None, etag=None, last_modified=None):
+        '''
+        Moves a finished download into the store, dropping it if an identical blob already exists
+        :params: file_id (str) - file id returned by fileId(); temp_path (str) - downloaded file;
+                 sha256 (str) - hex digest of the downloaded content; content_type (str, optional) - Content-Type header;
+                 etag, last_modified (str, optional) - validators for conditional requests
+        :return: dict with the blob 'path', 'size', 'etag' and 'last_modified'
+        '''
+        ext = extension(content_type, file_id)
+        path = self.blobPath(sha256, ext)
+        size = os.path.getsize(temp_path)
+        # a check of the blob running meanwhile would hash the replaced file
+        with self.verifyLock(path):
+            if os.path.exists(path) and os.path.getsize(path) == size and self.isIntact(path):
+                os.remove(temp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temp_path, path)
+            with self.lock:
+                self.verified.add(path)
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO files (id, sha256, ext, size, etag, last_modified) '
+                                    'VALUES (?, ?, ?, ?, ?, ?)', (file_id, sha256, ext, size, etag, last_modified))
+        return {'path': path, 'size': size, 'etag': etag, 'last_modified': last_modified}
+
+    def isIntact(self, path):
+        '''
+        Verifies a blob once per run and removes it if its content no longer matches its name
+        :params: path (str) - path to the blob
+        :return: bool
+        '''
+        with self.verifyLock(path):
+            with self.lock:
+                if path in self.verified:
+                    return True
+            if not os.path.exists(path):
+                return False
+            if not self.verify(path):
+                logging.warning(f'Removing corrupted blob {path}')
+                os.remove(path)
+                return False
+            with self.lock:
+                self.verified.add(path)
+        return True
+
+    def verifyLock(self, path):
+        '''
+        Returns a lock serializing checks and replacements of the same blob, so different blobs are hashed in parallel
+        :params: path (str) - path to the blob
+        :return: threading.RLock
+        '''
+        with self.lock:
+            return self.verify_locks.setdefault(path, threading.RLock())
+
+    def verify(self, path):
+        '''
+        Checks that a blob still matches the SHA-256 it is named after
+        :params: path (str) - path to the blob
+        :return: bool
+        '''
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha256.update(chunk)
+        return os.path.basename(path).startswith(sha256.hexdigest())
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def fileId(file):
+    '''
+    Returns the key of a Telegraph file in the blob store
+    :params: file (str) - Telegraph file name (ex. "abc.jpg") or absolute image URL
+    :return: file id string
+    '''
+    if '://' in file:
+        return 'url-' + hashlib.sha256(file.encode('utf-8')).hexdigest()
+    return file.split('?')[0]
+
+
+def extension(content_type, file):
+    '''
+    Picks a file extension from the Content-Type, falling back to the file name and then to ".jpg"
+    :params: content_type (str) - Content-Type header or None; file (str) - file name or id
+    :return: extension including the dot
+    '''
+    mime = (content_type or '').split(';')[0].strip().lower()
+    ext = EXTENSIONS.get(mime)
+    if not ext and mime.startswith(('image/', 'video/')):
+        ext = mimetypes.guess_extension(mime)
+    if not ext:
+        ext = os.path.splitext(file)[1].lower()
+    return ext if ext and len(ext) <= 6 else '.jpg'
+
+
+def linkInto(blob, destination):
+    '''
+    Makes `destination` point at a blob with a hardlink, falling back to a symlink and then to a copy
+    :params: blob (str) - path to the blob; destination (str) - output file path
+    :return: none
+    '''
+    temp_path = destination + '.link'
+    if os.path.lexists(temp_path):
+        os.remove(temp_path)
+    try:
+        os.link(blob, temp_path)
+    except OSError:
+        try:
+            os.symlink(os.path.abspath(blob), temp_path)
+        except OSError:
+            with open(blob, 'rb') as src, open(temp_path, 'wb') as dst:
+                for chunk in iter(lambda: src.read(1024 * 1024), b''):
+                    dst.write(chunk)
+    os.replace(temp_path, destination)
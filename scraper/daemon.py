@@ -0,0 +1,179 @@
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import sys
+import time
+
+SOCKET_PATH = os.path.join(os.path.expanduser('~'), '.telegraph-scraper.sock')
+# arguments holding paths, resolved against the working directory of the client
+PATH_ARGUMENTS = ('input_file', 'output_directory', 'metrics_file', 'prometheus_file')
+
+
+def socketArgument(argv):
+    '''
+    Finds the --socket argument of a scraper command line without building the full parser
+    :params: argv (list) - command line arguments
+    :return: socket path or None
+    '''
+    for position, arg in enumerate(argv):
+        if arg == '--':
+            # the rest is the query
+            return None
+        if arg == '--socket' and position + 1 < len(argv):
+            return argv[position + 1]
+        if arg.startswith('--socket='):
+            return arg.split('=', 1)[1]
+    return None
+
+
+def unixSocket():
+    if not hasattr(socket, 'AF_UNIX'):
+        raise RuntimeError('The telegraph-scraper daemon needs Unix sockets, which this platform does not support')
+    return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+
+def request(path, argv):
+    '''
+    Runs a scraper command line in a daemon and prints what the run printed
+    :params: path (str) - daemon socket; argv (list) - scraper command line arguments
+    :return: exit status of the run
+    '''
+    client = unixSocket()
+    try:
+        client.connect(path)
+    except OSError as ex:
+        print(f'No telegraph-scraper daemon is listening on {path}: {ex}', file=sys.stderr)
+        return 1
+    with client, client.makefile('rwb') as stream:
+        stream.write(json.dumps({'argv': argv, 'cwd': os.getcwd()}).encode('utf-8') + b'\n')
+        stream.flush()
+        line = stream.readline()
+    if not line:
+        print('The daemon closed the connection before the run finished', file=sys.stderr)
+        return 1
+    reply = json.loads(line)
+    sys.stdout.write(reply['output'])
+    return reply['status']
+
+
+def runRequest(argv, cwd):
+    '''
+    Runs one client command line in the daemon process. Requests are served one at a time,
+    so a run has the process metrics and standard streams to itself
+    :params: argv (list) - scraper command line arguments; cwd (str) - working directory of the client
+    :return: (exit status, text the run printed)
+    '''
+    from .metrics import metrics
+    from .telegraphscrape import parser, runArgs
+
+    started = time.monotonic()
+    output = io.StringIO()
+    status = 0
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+        try:
+            args = parser(argv)
+            for name in PATH_ARGUMENTS:
+                if getattr(args, name):
+                    setattr(args, name, os.path.join(cwd, getattr(args, name)))
+            # a metrics server started by one run would still hold the port during the next
+            args.prometheus_port = None
+            metrics.reset()
+            runArgs(args, progress=False)
+        except SystemExit as ex:
+            # argparse exits on --help and on invalid arguments
+            if isinstance(ex.code, str):
+                print(ex.code)
+            status = ex.code if isinstance(ex.code, int) else int(ex.code is not None)
+        except Exception as ex:
+            logging.exception(f'Error while serving {argv}')
+            print(f'Error: {ex}')
+            status = 1
+    logging.info(f'Served {argv} with status {status} in {time.monotonic() - started:.2f}s')
+    return status, output.getvalue()
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            # a connection probe, ex. from a second daemon checking the socket
+            return
+        message = json.loads(line)
+        status, output = runRequest(message['argv'], message['cwd'])
+        self.wfile.write(json.dumps({'status': status, 'output': output}, ensure_ascii=False).encode('utf-8') + b'\n')
+
+
+def serve(path=SOCKET_PATH):
+    '''
+    Serves scraper command lines sent with --socket from one long-lived process, so every run after
+    the first skips interpreter start-up, module imports, DNS lookups and connection set-up
+    :params: path (str) - Unix socket to listen on
+    :return: none
+    '''
+    probe = unixSocket()
+    try:
+        if os.path.exists(path):
+            try:
+                probe.connect(path)
+            except OSError:
+                # left behind by a daemon that did not shut down cleanly
+                os.unlink(path)
+            else:
+                raise RuntimeError(f'A telegraph-scraper daemon is already listening on {path}')
+    finally:
+        probe.close()
+
+    # everything a run needs is imported and the HTTP session created before the first request
+    from . import asyncindex, telegraphscrape
+    from .transport import Transport
+
+    Transport.shared()
+    # the socket is only accessible to the user running the daemon
+    umask = os.umask(0o177)
+    try:
+        server = socketserver.UnixStreamServer(path, RequestHandler)
+    finally:
+        os.umask(umask)
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    # service managers stop daemons with SIGTERM, background jobs ignore Ctrl+C
+    signal.signal(signal.SIGTERM, stop)
+    logging.info(f'Serving on {path}')
+    print(f'Serving on {path}, press Ctrl+C to stop')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
+        logging.info(f'Stopped serving on {path}')
+
+
+def parser(argv=None):
+    '''
+    Returns the serve parser arguments
+    :params: argv (list, optional) - arguments after "serve"
+    :return: parser.parse_args() object
+    '''
+    parser = argparse.ArgumentParser(prog='telegraph-scraper serve',
+                                     description='Runs scraper queries sent with --socket <SOCKET> in one long-lived process')
+    parser.add_argument('--socket', help=f'<SOCKET> (optional): Unix socket to listen on (default "{SOCKET_PATH}")',
+                        default=SOCKET_PATH)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    from .telegraphscrape import setupLogging
+
+    args = parser(argv)
+    setupLogging()
+    serve(args.socket)
@@ -0,0 +1,134 @@
+import hashlib
+import os
+import re
+import sqlite3
+import struct
+import threading
+
+PERMUTATIONS = 64
+BANDS = 16
+ROWS = PERMUTATIONS // BANDS
+# every digest yields 8 of the 64 hash values of a feature
+SALTS = [struct.pack('<Q', i) for i in range(PERMUTATIONS // 8)]
+WORD = re.compile(r'\w+')
+
+
+def features(text, images, shingle=3):
+    '''
+    Turns page text and image ids into fingerprint features: lowercased word shingles plus one feature per image
+    :params: text (list) - text runs of the page; images (list) - Telegraph file names of its images;
+             shingle (int) - words per shingle
+    :return: set of feature strings
+    '''
+    words = WORD.findall(' '.join(text).lower())
+    if len(words) < shingle:
+        shingles = words
+    else:
+        shingles = [' '.join(words[i:i + shingle]) for i in range(len(words) - shingle + 1)]
+    return set(shingles) | {'img:' + image for image in images}
+
+
+def minhash(items):
+    '''
+    Computes the MinHash signature of a feature set. The share of equal positions in two signatures
+    estimates the Jaccard similarity of the sets
+    :params: items (set) - feature strings
+    :return: tuple of PERMUTATIONS ints
+    '''
+    rows = []
+    for item in items:
+        data = item.encode('utf-8')
+        values = ()
+        for salt in SALTS:
+            values += struct.unpack('<8Q', hashlib.blake2b(data, digest_size=64, salt=salt).digest())
+        rows.append(values)
+    return tuple(map(min, zip(*rows)))
+
+
+def similarity(a, b):
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+def buckets(signature):
+    '''
+    Hashes each band of ROWS signature values into an LSH bucket. Sets with Jaccard similarity s share
+    at least one bucket with probability 1 - (1 - s ** ROWS) ** BANDS, 0.99 at s = 0.7
+    :params: signature (tuple) - MinHash signature
+    :return: list of BANDS signed 64-bit bucket ids
+    '''
+    ids = []
+    for band in range(BANDS):
+        packed = struct.pack(f'<B{ROWS}Q', band, *signature[band * ROWS:(band + 1) * ROWS])
+        ids.append(struct.unpack('<q', hashlib.blake2b(packed, digest_size=8).digest())[0])
+    return ids
+
+
+class FingerprintStore(object):
+    '''
+    MinHash signatures of pages shared by all queries and runs. Signatures are indexed by their LSH
+    buckets, so candidate duplicates are looked up without comparing against every page
+    '''
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                path TEXT PRIMARY KEY,
+                query TEXT,
+                signature BLOB NOT NULL,
+                duplicate_of TEXT
+            );
+            CREATE TABLE IF NOT EXISTS buckets (
+                bucket INTEGER NOT NULL,
+                path TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS buckets_bucket ON buckets (bucket);
+        ''')
+
+    def classify(self, path, query, signature, threshold=0.7):
+        '''
+        Finds the page a signature duplicates and records the signature. A page keeps the verdict it got
+        the first time it was seen, so the earliest copy stays the kept one and duplicates never chain
+        :params: path (str) - Telegraph page path; query (str) - scraper query of the page;
+                 signature (tuple) - MinHash signature; threshold (float) - estimated Jaccard similarity of a duplicate
+        :return: (path of the kept copy or None, True if the page was fingerprinted before)
+        '''
+        with self.lock:
+            row = self.connection.execute('SELECT duplicate_of FROM fingerprints WHERE path = ?', (path,)).fetchone()
+            if row is not None:
+                return row[0], True
+
+            ids = buckets(signature)
+            candidates = self.connection.execute(
+                'SELECT fingerprints.path, fingerprints.signature FROM fingerprints '
+                'WHERE duplicate_of IS NULL AND path IN '
+                f'(SELECT path FROM buckets WHERE bucket IN ({", ".join("?" * BANDS)}))',
+                ids
+            ).fetchall()
+            kept = None
+            for other, blob in candidates:
+                if similarity(signature, struct.unpack(f'<{PERMUTATIONS}Q', blob)) >= threshold:
+                    kept = other
+                    break
+
+            self.connection.execute('BEGIN')
+            try:
+                self.connection.execute('INSERT INTO fingerprints (path, query, signature, duplicate_of) VALUES (?, ?, ?, ?)',
+                                        (path, query, struct.pack(f'<{PERMUTATIONS}Q', *signature), kept))
+                if kept is None:
+                    # only kept copies are matched against, so duplicates need no buckets
+                    self.connection.executemany('INSERT INTO buckets (bucket, path) VALUES (?, ?)',
+                                                [(bucket, path) for bucket in ids])
+            except Exception:
+                self.connection.execute('ROLLBACK')
+                raise
+            self.connection.execute('COMMIT')
+        return kept, False
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,259 @@
+import hashlib
+import logging
+import os
+import queue
+import threading
+import time
+
+from .blobs import fileId, linkInto
+from .metrics import metrics
+
+
+class ByteBudget(object):
+    '''
+    Caps the total number of bytes downloads may have in flight at once
+    '''
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, size):
+        '''
+        Blocks until `size` bytes fit into the budget. A single download larger than
+        the whole budget is admitted once nothing else is in flight
+        :params: size (int) - number of bytes to reserve
+        :return: the number of bytes actually reserved
+        '''
+        size = min(size, self.limit)
+        with self.condition:
+            while self.in_flight and self.in_flight + size > self.limit:
+                self.condition.wait()
+            self.in_flight += size
+        return size
+
+    def release(self, size):
+        '''
+        Returns reserved bytes to the budget
+        :params: size (int) - number of bytes returned by acquire()
+        :return: none
+        '''
+        with self.condition:
+            self.in_flight -= size
+            self.condition.notify_all()
+
+
+class Bandwidth(object):
+    '''
+    Token bucket capping the bytes per second all downloads receive together, with bursts of up to one second
+    of traffic. A chunk may overdraw the bucket, the download then waits until the debt is paid off
+    '''
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, size):
+        '''
+        Takes received bytes from the bucket, sleeping while it is overdrawn
+        :params: size (int) - number of bytes received
+        :return: none
+        '''
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate) - size
+            self.updated = now
+            wait = -self.tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+
+class ImageDownloader(object):
+    '''
+    Downloads (page, image) jobs with a shared pool of workers on one pooled session.
+    Bodies are streamed in fixed-size chunks into the blob store, and page outputs are linked to the blobs
+    '''
+    def __init__(self, session, headers, file_url, blobs, journal, workers=4, chunk_size=64 * 1024,
+                 max_bytes=64 * 1024 * 1024, max_bandwidth=None, revalidate=False):
+        self.session = session
+        self.blobs = blobs
+        self.journal = journal
+        self.revalidate = revalidate
+        self.file_locks = {}
+        self.locks_guard = threading.Lock()
+        self.headers = headers
+        self.file_url = file_url
+        self.workers = max(1, workers)
+        self.chunk_size = chunk_size
+        self.budget = ByteBudget(max_bytes)
+        self.bandwidth = Bandwidth(max_bandwidth) if max_bandwidth else None
+        self.jobs = queue.Queue(maxsize=self.workers * 4)
+
+    def run(self, jobs, progress=None):
+        '''
+        Feeds jobs to the worker pool and waits until all of them are processed
+        :params: jobs (iterable) - (directory, index, file) tuples; progress (tqdm, optional) - updated per image
+        :return: none
+        '''
+        self.progress = progress
+        self.progress_lock = threading.Lock()
+        threads = [threading.Thread(target=self.worker, daemon=True) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            for job in jobs:
+                self.jobs.put(job)
+        finally:
+            for _ in threads:
+                self.jobs.put(None)
+            for thread in threads:
+                thread.join()
+
+    def worker(self):
+        '''
+        Takes jobs from the queue until it receives the stop marker
+        :params: none
+        :return: none
+        '''
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            directory, index, file = job
+            try:
+                self.fetch(file, directory, index)
+            except Exception as ex:
+                metrics.inc('images_total', result='error')
+                logging.error(f'Error downloading image {file}: {ex}')
+            if self.progress is not None:
+                with self.progress_lock:
+                    self.progress.update()
+
+    def fetch(self, file, directory, index):
+        '''
+        Links an image into the page directory. Outputs recorded in the journal are skipped (or revalidated
+        with a conditional request), and files already in the blob store are not downloaded again
+        :params: file (str) - Telegraph file name or absolute image URL; directory (str) - page directory;
+                 index (int) - image position on the page
+        :return: none
+        '''
+        page = os.path.basename(directory)
+        file_id = fileId(file)
+        entry = self.journal.get(page, index)
+        with self.fileLock(file_id):
+            if entry and entry['file'] == file and self.isComplete(os.path.join(directory, entry['name']), entry['size']):
+                metrics.inc('cache_lookups_total', cache='journal', result='hit')
+                if not self.revalidate:
+                    metrics.inc('images_total', result='skipped')
+                    return
+                blob = self.download(file, file_id, entry)
+                if blob is None:
+                    # 304 Not Modified
+                    metrics.inc('images_total', result='not_modified')
+                    return
+                metrics.inc('images_total', result='downloaded')
+            else:
+                metrics.inc('cache_lookups_total', cache='journal', result='miss')
+                blob = self.blobs.lookup(file_id)
+                metrics.inc('cache_lookups_total', cache='blobs', result='miss' if blob is None else 'hit')
+                if blob is None:
+                    blob = self.download(file, file_id)
+                    metrics.inc('images_total', result='downloaded')
+                else:
+                    metrics.inc('images_total', result='cached')
+
+        name = f'{index}{os.path.splitext(blob["path"])[1]}'
+        linkInto(blob['path'], os.path.join(directory, name))
+        self.journal.record(page, index, name=name, file=file, size=blob['size'],
+                            etag=blob['etag'], last_modified=blob['last_modified'])
+
+    def fileLock(self, file_id):
+        '''
+        Returns a lock serializing downloads of the same file within this run
+        :params: file_id (str) - blob store key
+        :return: threading.Lock
+        '''
+        with self.locks_guard:
+            return self.file_locks.setdefault(file_id, threading.Lock())
+
+    def isComplete(self, path, size):
+        return os.path.exists(path) and os.path.getsize(path) == size
+
+    def download(self, file, file_id, entry=None):
+        '''
+        Streams a single image into the blob store, hashing it on the way. A partial download left by an
+        interrupted run is resumed with an HTTP Range request; with a journal entry the request is conditional.
+        The partial download is claimed first, so other processes sharing the blob store wait for it
+        :params: file (str) - Telegraph file name or absolute image URL; file_id (str) - blob store key;
+                 entry (dict, optional) - journal entry whose etag/last_modified are sent as validators
+        :return: dict describing the blob (see BlobStore.add) or None if the server answered 304 Not Modified
+        '''
+        claim = self.blobs.claim(file_id)
+        try:
+            if claim is None:
+                # without file locks a partial download could be shared, so it is private and not resumed
+                return self.transfer(file, file_id, self.blobs.tempPath(), entry)
+            if entry is None:
+                # another process may have finished the file while this one waited for the claim
+                blob = self.blobs.lookup(file_id)
+                if blob is not None:
+                    return blob
+            return self.transfer(file, file_id, self.blobs.tempPath(file_id), entry)
+        finally:
+            if claim is not None:
+                self.blobs.release(claim)
+
+    def transfer(self, file, file_id, temp_path, entry=None):
+        '''
+        Runs the request of download() into a partial download, resuming it if it is not empty
+        :params: file (str) - Telegraph file name or absolute image URL; file_id (str) - blob store key;
+                 temp_path (str) - partial download; entry (dict, optional) - journal entry with validators
+        :return: dict describing the blob (see BlobStore.add) or None if the server answered 304 Not Modified
+        '''
+        url = file if '://' in file else f'{self.file_url}{file}'
+        # byte ranges have to refer to the stored representation
+        headers = dict(self.headers, **{'Accept-Encoding': 'identity'})
+        offset = os.path.getsize(temp_path) if os.path.exists(temp_path) else 0
+        if offset:
+            headers['Range'] = f'bytes={offset}-'
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        sha256 = hashlib.sha256()
+        with self.session.get(url, stream=True, headers=headers) as response:
+            if response.status_code == 304:
+                return None
+            if response.status_code == 416:
+                # the partial file is not a prefix of the current body
+                os.remove(temp_path)
+                return self.transfer(file, file_id, temp_path, entry)
+            response.raise_for_status()
+
+            if response.status_code == 206 and offset:
+                mode = 'ab'
+                with open(temp_path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                        sha256.update(chunk)
+            else:
+                mode = 'wb'
+
+            reserved = self.budget.acquire(int(response.headers.get('Content-Length') or self.chunk_size))
+            try:
+                # a failed download keeps its partial file so the next attempt can resume it
+                with open(temp_path, mode) as f:
+                    for chunk in response.iter_content(chunk_size=self.chunk_size):
+                        sha256.update(chunk)
+                        f.write(chunk)
+                        metrics.inc('downloaded_bytes_total', len(chunk))
+                        if self.bandwidth is not None:
+                            self.bandwidth.consume(len(chunk))
+            finally:
+                self.budget.release(reserved)
+            content_type = response.headers.get('Content-Type')
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+        return self.blobs.add(file_id, temp_path, sha256.hexdigest(), content_type, etag, last_modified)
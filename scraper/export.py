@@ -0,0 +1,160 @@
+import gzip
+import importlib
+import io
+import json
+import os
+
+FORMATS = ('jsonl.gz', 'jsonl.zst', 'parquet')
+FIELDS = ('path', 'url', 'title', 'author', 'views', 'text', 'links', 'images')
+
+
+def optionalModule(name, feature, extra):
+    '''
+    Imports an optional dependency when a format first needs it, keeping start-up free of pyarrow and zstandard
+    :params: name (str) - module name; feature (str) - what needs the module, for the error message;
+             extra (str) - setup.py extra that installs it
+    :return: module
+    '''
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        raise RuntimeError(f'{feature} requires {name.split(".")[0]}: pip install "telegraph-scraper[{extra}]"') from None
+
+
+def openExporter(directory, name, fmt, batch_size=1000):
+    '''
+    Creates the exporter for a format
+    :params: directory (str) - output directory; name (str) - file name without extension;
+             fmt (str) - one of FORMATS; batch_size (int) - records per compressed batch or row group
+    :return: JsonlExporter or ParquetExporter
+    '''
+    path = os.path.join(directory, f'{name}.{fmt}')
+    if fmt == 'parquet':
+        return ParquetExporter(path, batch_size)
+    if fmt in ('jsonl.gz', 'jsonl.zst'):
+        return JsonlExporter(path, fmt.split('.')[1], batch_size)
+    raise ValueError(f'Unknown export format: {fmt}')
+
+
+class JsonlExporter(object):
+    '''
+    Writes records as JSON lines into a single compressed file. Every batch is compressed as an
+    independent gzip member or zstd frame, so the file is readable by plain zcat/zstdcat, and the
+    byte range of each batch is listed in a "<file>.idx" sidecar so readers can seek to any batch
+    '''
+    def __init__(self, path, compression='gz', batch_size=1000):
+        if compression == 'zst':
+            self.zstandard = optionalModule('zstandard', 'The jsonl.zst export', 'zstd')
+        self.path = path
+        self.compression = compression
+        self.batch_size = max(1, batch_size)
+        self.buffer = []
+        self.index = []
+        self.count = 0
+        self.file = open(path + '.tmp', 'wb')
+
+    def write(self, record):
+        '''
+        Buffers a record, writing a compressed batch once `batch_size` records are buffered
+        :params: record (dict) - exported page fields
+        :return: none
+        '''
+        self.buffer.append(record)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        data = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in self.buffer).encode('utf-8')
+        if self.compression == 'zst':
+            compressed = self.zstandard.ZstdCompressor(level=10).compress(data)
+        else:
+            compressed = gzip.compress(data, compresslevel=6)
+        self.index.append({'offset': self.file.tell(), 'length': len(compressed), 'first': self.count,
+                           'records': len(self.buffer), 'path': self.buffer[0]['path']})
+        self.file.write(compressed)
+        self.count += len(self.buffer)
+        self.buffer = []
+
+    def close(self):
+        '''
+        Writes the last batch and the index and moves the file into place
+        :params: none
+        :return: number of exported records
+        '''
+        self.flush()
+        self.file.close()
+        with open(self.path + '.idx.tmp', 'w', encoding='utf-8') as f:
+            for entry in self.index:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        os.replace(self.path + '.tmp', self.path)
+        os.replace(self.path + '.idx.tmp', self.path + '.idx')
+        return self.count
+
+
+class ParquetExporter(object):
+    '''
+    Writes records into a Parquet file, one row group per batch
+    '''
+    def __init__(self, path, batch_size=1000):
+        pyarrow = self.pyarrow = optionalModule('pyarrow', 'The parquet export', 'parquet')
+        self.parquet = optionalModule('pyarrow.parquet', 'The parquet export', 'parquet')
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        self.buffer = []
+        self.count = 0
+        strings = pyarrow.list_(pyarrow.string())
+        self.schema = pyarrow.schema([
+            ('path', pyarrow.string()),
+            ('url', pyarrow.string()),
+            ('title', pyarrow.string()),
+            ('author', pyarrow.string()),
+            ('views', pyarrow.int64()),
+            ('text', pyarrow.string()),
+            ('links', strings),
+            ('images', strings),
+        ])
+        self.writer = self.parquet.ParquetWriter(path + '.tmp', self.schema, compression='zstd')
+
+    def write(self, record):
+        self.buffer.append(record)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        columns = {field: [record[field] for record in self.buffer] for field in FIELDS}
+        self.writer.write_table(self.pyarrow.Table.from_pydict(columns, schema=self.schema))
+        self.count += len(self.buffer)
+        self.buffer = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        os.replace(self.path + '.tmp', self.path)
+        return self.count
+
+
+def readRecords(path, batch=None):
+    '''
+    Streams the records of a JSON lines export, optionally only one batch of it located through the index
+    :params: path (str) - .jsonl.gz or .jsonl.zst export; batch (int, optional) - batch number in the index
+    :return: generator of record dicts
+    '''
+    with open(path, 'rb') as f:
+        if batch is not None:
+            with open(path + '.idx', 'r', encoding='utf-8') as index:
+                entry = [json.loads(line) for line in index][batch]
+            f.seek(entry['offset'])
+            raw = io.BytesIO(f.read(entry['length']))
+        else:
+            raw = f
+        if path.endswith('.zst'):
+            zstandard = optionalModule('zstandard', 'Reading jsonl.zst exports', 'zstd')
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+        else:
+            stream = gzip.GzipFile(fileobj=raw)
+        for line in io.TextIOWrapper(stream, encoding='utf-8'):
+            yield json.loads(line)
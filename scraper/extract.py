@@ -0,0 +1,65 @@
+BLOCK_TAGS = {'p', 'h3', 'h4', 'blockquote', 'aside', 'li', 'pre', 'figcaption'}
+MEDIA_TAGS = {'video', 'iframe'}
+FILE_PREFIXES = ('/file/', 'https://telegra.ph/file/', 'http://telegra.ph/file/')
+
+_END = object()
+
+
+def extractContent(content):
+    '''
+    Walks a Telegraph node tree once, without recursion, and collects everything the output stages need
+    :params: content (list) - the "content" node list of a telegraph page
+    :return: dict with 'images' (image sources), 'text' (normalized text runs, one per block element),
+             'links' (hrefs), 'length' (total text length) and 'media' (video/iframe sources)
+    '''
+    record = {'images': [], 'text': [], 'links': [], 'length': 0, 'media': []}
+    parts = []
+
+    def flush():
+        text = ' '.join(''.join(parts).split())
+        parts.clear()
+        if text:
+            record['text'].append(text)
+            record['length'] += len(text)
+
+    stack = list(reversed(content or []))
+    while stack:
+        node = stack.pop()
+        if node is _END:
+            flush()
+            continue
+        if isinstance(node, str):
+            parts.append(node)
+            continue
+        if not isinstance(node, dict):
+            continue
+
+        tag = node.get('tag')
+        attrs = node.get('attrs') or {}
+        if tag == 'img' and 'src' in attrs:
+            record['images'].append(attrs['src'])
+        elif tag in MEDIA_TAGS and 'src' in attrs:
+            record['media'].append(attrs['src'])
+        elif tag == 'a' and 'href' in attrs:
+            record['links'].append(attrs['href'])
+        elif tag == 'br':
+            parts.append(' ')
+
+        if tag in BLOCK_TAGS:
+            flush()
+            stack.append(_END)
+        stack.extend(reversed(node.get('children') or []))
+    flush()
+    return record
+
+
+def imageFile(src):
+    '''
+    Converts an image source to a Telegraph file name, keeping external URLs as they are
+    :params: src (str) - "src" attribute of an img node
+    :return: file name (ex. "abc.jpg") or absolute URL
+    '''
+    for prefix in FILE_PREFIXES:
+        if src.startswith(prefix):
+            return src[len(prefix):]
+    return src
@@ -0,0 +1,127 @@
+import re
+
+from . import extra
+from .dedup import features, minhash
+from .extract import imageFile
+from .metrics import metrics
+
+PATH_DATE = re.compile(r'-(\d{2}-\d{2})(?:-\d+)?$')
+
+
+def spamAuthors(spam=None):
+    '''
+    Rejects pages whose author is in the spam list
+    :params: spam (set, optional) - author names, defaults to extra.spam
+    :return: predicate
+    '''
+    spam = extra.spam if spam is None else spam
+
+    def predicate(page):
+        return page['result'].get('author_name') not in spam
+    return predicate
+
+
+def titleMatches(pattern):
+    '''
+    Keeps pages whose title matches a regular expression (case-insensitive search)
+    :params: pattern (str) - regular expression
+    :return: predicate
+    '''
+    regex = re.compile(pattern, re.IGNORECASE)
+
+    def predicate(page):
+        return regex.search(page['result'].get('title') or '') is not None
+    return predicate
+
+
+def dateWindow(start=None, end=None):
+    '''
+    Keeps pages published between two MM-DD dates, inclusive. A window with start > end wraps
+    around the new year, ex. "12-01" to "01-31"
+    :params: start (str, optional) - MM-DD; end (str, optional) - MM-DD
+    :return: predicate
+    '''
+    start = start or '01-01'
+    end = end or '12-31'
+
+    def predicate(page):
+        match = PATH_DATE.search(page['result']['path'])
+        if match is None:
+            return False
+        date = match.group(1)
+        if start <= end:
+            return start <= date <= end
+        return date >= start or date <= end
+    return predicate
+
+
+def minViews(views):
+    '''
+    Keeps pages with at least the given number of views
+    :params: views (int) - minimum views
+    :return: predicate
+    '''
+    def predicate(page):
+        return page['result'].get('views', 0) >= views
+    return predicate
+
+
+def textLength(extract, min_length=None, max_length=None):
+    '''
+    Keeps pages whose text length is within bounds. Needs page content
+    :params: extract (callable) - returns the extraction record of a page; min_length, max_length (int, optional) - bounds
+    :return: predicate
+    '''
+    def predicate(page):
+        length = extract(page)['length']
+        return (min_length is None or length >= min_length) and (max_length is None or length <= max_length)
+    return predicate
+
+
+def imageCount(extract, min_images=None, max_images=None):
+    '''
+    Keeps pages whose number of images is within bounds. Needs page content
+    :params: extract (callable) - returns the extraction record of a page; min_images, max_images (int, optional) - bounds
+    :return: predicate
+    '''
+    def predicate(page):
+        count = len(extract(page)['images'])
+        return (min_images is None or count >= min_images) and (max_images is None or count <= max_images)
+    return predicate
+
+
+def nearDuplicates(extract, fingerprints, query, threshold=0.7, min_features=5):
+    '''
+    Keeps the first copy of near-identical pages, judged by MinHash signatures of their text shingles and image ids.
+    Signatures are kept in a FingerprintStore shared by all queries and runs. Needs page content
+    :params: extract (callable) - returns the extraction record of a page; fingerprints (FingerprintStore) - fingerprint store;
+             query (str) - scraper query; threshold (float) - estimated Jaccard similarity of a duplicate;
+             min_features (int) - pages with fewer distinct text shingles and images are always kept
+    :return: predicate
+    '''
+    def predicate(page):
+        record = extract(page)
+        items = features(record['text'], [imageFile(src) for src in record['images']])
+        if len(items) < min_features:
+            return True
+        canonical, known = fingerprints.classify(page['result']['path'], query, minhash(items), threshold)
+        metrics.inc('cache_lookups_total', cache='fingerprints', result='hit' if known else 'miss')
+        return canonical is None
+    return predicate
+
+
+def applyFilters(pages, filters, rejected=None):
+    '''
+    Lazily yields the pages that pass every filter. Filters run in order and stop at the first rejection
+    :params: pages (iterable) - JSON data for telegraph pages; filters (list) - (name, predicate) pairs;
+             rejected (dict, optional) - incremented with the number of pages rejected by each filter name
+    :return: generator of pages
+    '''
+    for page in pages:
+        for name, predicate in filters:
+            if not predicate(page):
+                if rejected is not None:
+                    rejected[name] = rejected.get(name, 0) + 1
+                break
+        else:
+            yield page
@@ -0,0 +1,76 @@
+import json
+import logging
+import os
+import threading
+
+
+class DownloadJournal(object):
+    '''
+    Append-only log of completed downloads of a query. Each line records one finished
+    (page, index) output, so a restarted run skips everything that was already written
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        lines = 0
+        torn = False
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    lines += 1
+                    torn = not line.endswith('\n')
+                    try:
+                        entry = json.loads(line)
+                        self.entries[(entry['page'], entry['index'])] = entry
+                    except (ValueError, KeyError):
+                        # a torn last line left by a crash
+                        continue
+        if lines > 2 * len(self.entries) + 100:
+            self.compact()
+        self.file = open(path, 'a', encoding='utf-8')
+        if torn:
+            self.file.write('\n')
+
+    def get(self, page, index):
+        '''
+        Returns the journal entry of an output
+        :params: page (str) - Telegraph page path; index (int) - image position on the page
+        :return: dict entry or None
+        '''
+        return self.entries.get((page, index))
+
+    def record(self, page, index, **entry):
+        '''
+        Appends a completed output to the journal
+        :params: page (str) - Telegraph page path; index (int) - image position on the page;
+                 entry - name, file, size, etag and last_modified of the output
+        :return: none
+        '''
+        entry.update(page=page, index=index)
+        line = json.dumps(entry, ensure_ascii=False) + '\n'
+        with self.lock:
+            self.entries[(page, index)] = entry
+            self.file.write(line)
+            self.file.flush()
+
+    def compact(self):
+        '''
+        Rewrites the journal with only the latest entry per output
+        :params: none
+        :return: none
+        '''
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for entry in self.entries.values():
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        logging.info(f'Compacted download journal: {self.path}')
+
+    def close(self):
+        with self.lock:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
@@ -0,0 +1,256 @@
+import functools
+import json
+import os
+import threading
+import time
+
+PREFIX = 'telegraph_scraper_'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+
+class Metrics(object):
+    '''
+    Process-wide registry of labelled counters and latency histograms
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        '''
+        Increments a counter
+        :params: name (str) - metric name without prefix; value (float) - increment; labels - label values
+        :return: none
+        '''
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        '''
+        Records a value in a histogram
+        :params: name (str) - metric name without prefix; value (float) - observed value; labels - label values
+        :return: none
+        '''
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets': [0] * len(LATENCY_BUCKETS), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    histogram['buckets'][i] += 1
+                    break
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def value(self, name, **labels):
+        '''
+        Sums a counter over all label sets matching the given labels
+        :params: name (str) - metric name without prefix; labels - label values to match
+        :return: float
+        '''
+        with self.lock:
+            return sum(value for (key, key_labels), value in self.counters.items()
+                       if key == name and set(labels.items()) <= set(key_labels))
+
+    def snapshot(self):
+        '''
+        Returns a picklable copy of all metrics, used to merge results of pool processes
+        :params: none
+        :return: dict
+        '''
+        with self.lock:
+            return {
+                'counters': dict(self.counters),
+                'histograms': {key: {'buckets': list(h['buckets']), 'sum': h['sum'], 'count': h['count']}
+                               for key, h in self.histograms.items()},
+            }
+
+    def merge(self, snapshot):
+        '''
+        Adds a snapshot taken in another process to this registry
+        :params: snapshot (dict) - output of snapshot()
+        :return: none
+        '''
+        with self.lock:
+            for key, value in snapshot['counters'].items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, other in snapshot['histograms'].items():
+                histogram = self.histograms.setdefault(key, {'buckets': [0] * len(LATENCY_BUCKETS), 'sum': 0.0, 'count': 0})
+                histogram['buckets'] = [a + b for a, b in zip(histogram['buckets'], other['buckets'])]
+                histogram['sum'] += other['sum']
+                histogram['count'] += other['count']
+
+    def toJSON(self):
+        '''
+        Renders all metrics plus derived rates and ratios as a JSON-serializable dict
+        :params: none
+        :return: dict
+        '''
+        snapshot = self.snapshot()
+        counters = {formatKey(PREFIX + name, labels): value for (name, labels), value in snapshot['counters'].items()}
+        histograms = {}
+        for (name, labels), h in snapshot['histograms'].items():
+            histograms[formatKey(PREFIX + name, labels)] = {
+                'count': h['count'],
+                'sum': round(h['sum'], 6),
+                'p50': bucketQuantile(h, 0.5),
+                'p99': bucketQuantile(h, 0.99),
+                'buckets': {formatBound(bound): count for bound, count in zip(LATENCY_BUCKETS, h['buckets'])},
+            }
+
+        derived = {'cache_hit_ratio': {}}
+        images_seconds = self.value('stage_seconds_total', stage='images')
+        images = self.value('images_total') - self.value('images_total', result='error')
+        derived['images_per_second'] = round(images / images_seconds, 3) if images_seconds else 0.0
+        http_requests = self.value('http_requests_total')
+        connections = self.value('http_connections_total')
+        derived['connection_reuse_ratio'] = round(max(0, http_requests - connections) / http_requests, 4) if http_requests else 0.0
+        caches = {dict(labels).get('cache') for name, labels in snapshot['counters'] if name == 'cache_lookups_total'}
+        for cache in sorted(caches):
+            hits = self.value('cache_lookups_total', cache=cache, result='hit')
+            total = self.value('cache_lookups_total', cache=cache)
+            derived['cache_hit_ratio'][cache] = round(hits / total, 4) if total else 0.0
+        return {'counters': counters, 'histograms': histograms, 'derived': derived}
+
+    def toPrometheus(self):
+        '''
+        Renders all metrics in the Prometheus text exposition format
+        :params: none
+        :return: str
+        '''
+        snapshot = self.snapshot()
+        lines = []
+        for name in sorted({name for name, _ in snapshot['counters']}):
+            lines.append(f'# TYPE {PREFIX}{name} counter')
+            for (key, labels), value in sorted(snapshot['counters'].items()):
+                if key == name:
+                    lines.append(f'{formatKey(PREFIX + name, labels)} {value}')
+        for name in sorted({name for name, _ in snapshot['histograms']}):
+            lines.append(f'# TYPE {PREFIX}{name} histogram')
+            for (key, labels), h in sorted(snapshot['histograms'].items()):
+                if key != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, h['buckets']):
+                    cumulative += count
+                    lines.append(f'{formatKey(PREFIX + name + "_bucket", labels + (("le", formatBound(bound)),))} {cumulative}')
+                lines.append(f'{formatKey(PREFIX + name + "_sum", labels)} {h["sum"]}')
+                lines.append(f'{formatKey(PREFIX + name + "_count", labels)} {h["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def writeJSON(self, path):
+        writeAtomic(path, json.dumps(self.toJSON(), indent=4))
+
+    def writePrometheus(self, path):
+        writeAtomic(path, self.toPrometheus())
+
+    def serve(self, port, host='127.0.0.1'):
+        '''
+        Serves the Prometheus exposition on /metrics from a background thread
+        :params: port (int) - TCP port; host (str) - bind address
+        :return: ThreadingHTTPServer
+        '''
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.toPrometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+metrics = Metrics()
+
+
+def timed(stage):
+    '''
+    Decorator adding the wall time of a Scraper stage to stage_seconds_total
+    :params: stage (str) - stage label
+    :return: decorator
+    '''
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            started = time.monotonic()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                metrics.inc('stage_seconds_total', time.monotonic() - started, stage=stage)
+        return wrapper
+    return decorator
+
+
+def requestOutcome(status, data):
+    '''
+    Classifies a getPage response for the api_requests_total counter
+    :params: status (int) - HTTP status code or None on a network error; data (dict) - decoded JSON body or None
+    :return: 'ok', 'miss', 'throttled' or 'error'
+    '''
+    if status == 429 or (data and str(data.get('error', '')).startswith('FLOOD_WAIT_')):
+        return 'throttled'
+    if status is None or status >= 500 or data is None:
+        return 'error'
+    return 'ok' if data.get('ok') else 'miss'
+
+
+def bucketQuantile(histogram, q):
+    '''
+    Estimates a quantile as the upper bound of the bucket containing it
+    :params: histogram (dict) - histogram snapshot; q (float) - quantile, 0-1
+    :return: float or None for an empty histogram
+    '''
+    if not histogram['count']:
+        return None
+    rank = q * histogram['count']
+    cumulative = 0
+    for bound, count in zip(LATENCY_BUCKETS, histogram['buckets']):
+        cumulative += count
+        if cumulative >= rank:
+            return bound if bound != float('inf') else None
+    return None
+
+
+def formatBound(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+def formatKey(name, labels):
+    if not labels:
+        return name
+    rendered = ','.join(f'{key}="{str(value)}"' for key, value in labels)
+    return f'{name}{{{rendered}}}'
+
+
+def writeAtomic(path, text):
+    '''
+    Writes a file through a temporary file and a rename, so readers never see a partial file
+    :params: path (str) - output file; text (str) - content
+    :return: none
+    '''
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(temp_path, path)
@@ -0,0 +1,176 @@
+import random
+import re
+import threading
+import time
+
+from email.utils import parsedate_to_datetime
+
+
+class TokenBucket(object):
+    '''
+    Token bucket allowing `rate` requests per second with bursts of up to `burst` requests.
+    Not thread-safe on its own, RateLimiter calls it under its lock
+    '''
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def take(self, now):
+        '''
+        Takes one token if available
+        :params: now (float) - current time.monotonic() value
+        :return: 0 when a token was taken, otherwise seconds until the next token
+        '''
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter(object):
+    '''
+    Request layer between the scraper and the network: a token bucket, AIMD adaptive
+    concurrency driven by 429/5xx/latency signals, exponential backoff with jitter,
+    Retry-After handling and a maximum number of attempts per request
+    '''
+    def __init__(self, rate=None, burst=None, concurrency=None, min_concurrency=1, max_attempts=5,
+                 base_delay=0.5, max_delay=60.0, latency_target=5.0, cooldown=1.0):
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.limit = float(concurrency) if concurrency else float('inf')
+        self.max_concurrency = self.limit
+        self.min_concurrency = min_concurrency
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.latency_target = latency_target
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.decreased_at = 0.0
+        self.condition = threading.Condition(threading.RLock())
+
+    def tryAcquire(self):
+        '''
+        Takes a request slot if the limiter allows it
+        :params: none
+        :return: 0 when a slot was taken, seconds to wait, or None to wait for a running request to finish
+        '''
+        now = time.monotonic()
+        with self.condition:
+            if now < self.paused_until:
+                return self.paused_until - now
+            if self.in_flight >= self.limit:
+                return None
+            if self.bucket is not None:
+                wait = self.bucket.take(now)
+                if wait:
+                    return wait
+            self.in_flight += 1
+            return 0
+
+    def acquire(self):
+        '''
+        Blocks the calling thread until a request may be sent
+        :params: none
+        :return: none
+        '''
+        with self.condition:
+            while True:
+                wait = self.tryAcquire()
+                if wait == 0:
+                    return
+                self.condition.wait(wait)
+
+    async def acquireAsync(self):
+        '''
+        Waits without blocking the event loop until a request may be sent
+        :params: none
+        :return: none
+        '''
+        # only the async engine runs an event loop, so asyncio stays out of the common start-up
+        import asyncio
+
+        while True:
+            wait = self.tryAcquire()
+            if wait == 0:
+                return
+            await asyncio.sleep(wait or 0.01)
+
+    def release(self, status, latency):
+        '''
+        Frees a request slot and adapts the concurrency limit: additive increase on fast
+        successful responses, multiplicative decrease on throttling, server errors and slow responses
+        :params: status (int) - HTTP status code or None on a network error; latency (float) - seconds
+        :return: none
+        '''
+        now = time.monotonic()
+        with self.condition:
+            self.in_flight -= 1
+            congested = status is None or status == 429 or status >= 500 or latency > self.latency_target
+            if congested:
+                if now - self.decreased_at >= self.cooldown:
+                    self.decreased_at = now
+                    self.limit = max(self.min_concurrency, min(self.limit, self.in_flight + 1) / 2)
+            elif self.limit < self.max_concurrency:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    def pause(self, seconds):
+        '''
+        Stops all requests for the given number of seconds
+        :params: seconds (float) - pause length
+        :return: none
+        '''
+        with self.condition:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def backoff(self, attempt):
+        '''
+        Exponential backoff with full jitter
+        :params: attempt (int) - zero-based attempt number
+        :return: seconds to wait before the next attempt
+        '''
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def retryDelay(self, attempt, status, data, retry_after=None):
+        '''
+        Decides whether a response is final or the request has to be retried
+        :params: attempt (int) - zero-based attempt number; status (int) - HTTP status code or None on a network error;
+                 data (dict) - decoded JSON body or None; retry_after (str, optional) - Retry-After header value
+        :return: None if the response is final, otherwise seconds to wait before retrying
+        '''
+        wait = None
+        if data is not None and not data.get('ok'):
+            match = re.match(r'FLOOD_WAIT_(\d+)', str(data.get('error', '')))
+            if match:
+                wait = float(match.group(1))
+        if wait is None:
+            if status is not None and status < 500 and status != 429:
+                return None
+            wait = parseRetryAfter(retry_after)
+        if wait is not None:
+            self.pause(min(wait, self.max_delay))
+            return min(wait, self.max_delay)
+        return self.backoff(attempt)
+
+
+def parseRetryAfter(value):
+    '''
+    Parses a Retry-After header given either in seconds or as an HTTP date
+    :params: value (str) - header value or None
+    :return: seconds to wait or None
+    '''
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
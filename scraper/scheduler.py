@@ -0,0 +1,102 @@
+import collections
+import logging
+import threading
+import time
+
+from .metrics import metrics
+
+INDEX = 'index'
+CONTENT = 'content'
+IMAGE = 'image'
+WRITE = 'write'
+# downstream work first: writes and images finish pages, index probes only add new ones
+PRIORITIES = (WRITE, IMAGE, CONTENT, INDEX)
+
+
+class Scheduler(object):
+    '''
+    Runs index, content, image and write tasks on one pool of worker threads. A free worker always takes
+    the oldest task of the highest-priority kind that is under its concurrency limit and whose gate is open,
+    so the stages overlap instead of waiting for each other. Tasks may submit further tasks
+    '''
+    def __init__(self, workers, limits=None, gates=None):
+        '''
+        :params: workers (int) - worker threads, the global concurrency budget;
+                 limits (dict, optional) - {kind: maximum tasks of that kind running at once} (default: workers);
+                 gates (dict, optional) - {kind: callable}, tasks of a kind only start while it returns True
+        '''
+        self.workers = max(1, workers)
+        self.limits = dict(limits or {})
+        self.gates = dict(gates or {})
+        self.queues = {kind: collections.deque() for kind in PRIORITIES}
+        self.running = dict.fromkeys(PRIORITIES, 0)
+        self.pending = 0
+        self.condition = threading.Condition()
+
+    def submit(self, kind, fn, *args):
+        '''
+        Queues a task
+        :params: kind (str) - one of PRIORITIES; fn (callable) - the task; args - task arguments
+        :return: none
+        '''
+        with self.condition:
+            self.queues[kind].append((fn, args))
+            self.pending += 1
+            self.condition.notify()
+
+    def run(self):
+        '''
+        Runs queued tasks, and the tasks they submit, until none are left
+        :params: none
+        :return: none
+        '''
+        if not self.pending:
+            return
+        threads = [threading.Thread(target=self.worker, daemon=True) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def next(self):
+        '''
+        Picks the next runnable task, called with the condition held. Gates are ignored when nothing is
+        running, since no running task could open them
+        :params: none
+        :return: (kind, (fn, args)) or None
+        '''
+        idle = not any(self.running.values())
+        for kind in PRIORITIES:
+            if not self.queues[kind] or self.running[kind] >= self.limits.get(kind, self.workers):
+                continue
+            gate = self.gates.get(kind)
+            if gate is None or idle or gate():
+                return kind, self.queues[kind].popleft()
+        return None
+
+    def worker(self):
+        while True:
+            with self.condition:
+                task = self.next()
+                while task is None and self.pending:
+                    self.condition.wait()
+                    task = self.next()
+                if task is None:
+                    return
+                kind, (fn, args) = task
+                self.running[kind] += 1
+
+            started = time.monotonic()
+            result = 'ok'
+            try:
+                fn(*args)
+            except Exception as ex:
+                result = 'error'
+                logging.error(f'Error in {kind} task: {ex}')
+            metrics.inc('scheduler_tasks_total', kind=kind, result=result)
+            metrics.inc('scheduler_busy_seconds_total', time.monotonic() - started, kind=kind)
+
+            with self.condition:
+                self.running[kind] -= 1
+                self.pending -= 1
+                self.condition.notify_all()
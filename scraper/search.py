@@ -0,0 +1,91 @@
+import argparse
+import glob
+import logging
+import os
+import sqlite3
+import time
+
+from .store import PageStore
+from .telegraphscrape import Scraper, setupLogging
+
+CACHE_DIRECTORY = os.path.join(os.path.dirname(__file__), 'cache')
+STORE_SUFFIX = '_cache_store.sqlite'
+
+
+def storePaths(cache_directory, queries=None):
+    '''
+    Lists the page stores to search
+    :params: cache_directory (str) - directory holding the page stores; queries (list, optional) - search queries
+             whose stores are searched (default: all stores)
+    :return: list of store paths
+    '''
+    if queries:
+        paths = [os.path.join(cache_directory, Scraper.formatQuery(query) + STORE_SUFFIX) for query in queries]
+        return [path for path in paths if os.path.exists(path)]
+    return sorted(glob.glob(os.path.join(cache_directory, '*' + STORE_SUFFIX)))
+
+
+def search(terms, paths, limit=20):
+    '''
+    Searches the full-text index of every page store and merges the results. bm25 scores depend on the
+    statistics of the index they come from, so scores of each store are divided by its best score
+    before they are compared
+    :params: terms (str) - full-text query; paths (list) - page store paths; limit (int) - maximum number of results
+    :return: list of result dicts (see PageStore.search) with 'relevance' (1.0 for the best match of a store),
+             best matches first
+    '''
+    results = []
+    for path in paths:
+        try:
+            store = PageStore(path, readonly=True)
+        except sqlite3.Error as ex:
+            logging.error(f'Cannot read {path}: {ex}')
+            continue
+        try:
+            if not store.fts:
+                logging.warning(f'No search index in {path}, it is built the next time its query is scraped')
+                continue
+            matches = store.search(terms, limit)
+        finally:
+            store.close()
+        for result in matches:
+            # bm25 scores are negative, the best match has the lowest score
+            result['relevance'] = result['score'] / matches[0]['score'] if matches[0]['score'] else 1.0
+        results.extend(matches)
+    results.sort(key=lambda result: (-result['relevance'], result['score']))
+    return results[:limit]
+
+
+def parser(argv=None):
+    '''
+    Returns the search parser arguments
+    :params: argv (list, optional) - arguments after "search"
+    :return: parser.parse_args() object
+    '''
+    parser = argparse.ArgumentParser(prog='telegraph-scraper search',
+                                     description='Searches the text and titles of cached Telegraph pages')
+    parser.add_argument('TERMS', help='words to search for, or an SQLite FTS5 query (ex. "cat AND (dog OR bird)")', nargs='+')
+    parser.add_argument('-q', '--query', help='<QUERY> (optional): only search pages of this scraper query, can be repeated',
+                        action='append')
+    parser.add_argument('-n', '--limit', help='<LIMIT> (optional): number of results (default 20)', type=int, default=20)
+    parser.add_argument('--snippets', action='store_true', help='print a matching text fragment under every result')
+    parser.add_argument('--cache-directory', help='<CACHE_DIRECTORY> (optional): directory holding the page stores',
+                        default=CACHE_DIRECTORY)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parser(argv)
+    setupLogging()
+    paths = storePaths(args.cache_directory, args.query)
+    if not paths:
+        print('No cached pages to search')
+        return
+
+    started = time.monotonic()
+    results = search(' '.join(args.TERMS), paths, args.limit)
+    logging.info(f'Searched {len(paths)} page stores for "{" ".join(args.TERMS)}" in {time.monotonic() - started:.3f}s')
+    for result in results:
+        print(f'{result["url"]}  {result["title"]}')
+        if args.snippets and result['snippet']:
+            print(f'    {" ".join(result["snippet"].split())}')
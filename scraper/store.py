@@ -0,0 +1,393 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from urllib.request import pathname2url
+
+from .extract import extractContent
+
+
+class PageStore(object):
+    '''
+    SQLite-backed page store keyed by Telegraph path. Pages are written once when
+    they are first seen and loaded one by one on access. Titles and page text are kept
+    in an FTS5 full-text index that is updated with every write. Read-only stores are opened
+    as they are, without creating tables or building the index
+    '''
+    def __init__(self, path, readonly=False):
+        self.path = path
+        self.lock = threading.RLock()
+        if readonly:
+            self.connection = sqlite3.connect(f'file:{pathname2url(os.path.abspath(path))}?mode=ro', uri=True,
+                                              check_same_thread=False, isolation_level=None)
+            try:
+                self.fts = self.getMeta('fts') is not None
+            except sqlite3.Error:
+                # not a page store, or a WAL store in a directory this process cannot write to
+                self.connection.close()
+                raise
+            if self.fts:
+                try:
+                    self.connection.execute('SELECT 1 FROM pages_fts LIMIT 1')
+                except sqlite3.OperationalError:
+                    logging.warning(f'SQLite was built without FTS5, search is disabled for: {path}')
+                    self.fts = False
+            return
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS pages (
+                path TEXT PRIMARY KEY,
+                data TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            CREATE TABLE IF NOT EXISTS dates (
+                date TEXT PRIMARY KEY,
+                high INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS misses (
+                slug TEXT PRIMARY KEY,
+                checked_at REAL NOT NULL
+            );
+        ''')
+        try:
+            # rows share the rowid of their page
+            self.connection.execute('CREATE VIRTUAL TABLE IF NOT EXISTS pages_fts USING fts5(path UNINDEXED, title, text)')
+            self.fts = True
+        except sqlite3.OperationalError:
+            logging.warning(f'SQLite was built without FTS5, search is disabled for: {path}')
+            self.fts = False
+        if self.fts and self.getMeta('fts') is None:
+            self.buildSearchIndex()
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+
+    def __contains__(self, path):
+        with self.lock:
+            row = self.connection.execute('SELECT 1 FROM pages WHERE path = ?', (path,)).fetchone()
+        return row is not None
+
+    def paths(self):
+        '''
+        Returns the paths of all stored pages without loading their data
+        :params: none
+        :return: list of page paths
+        '''
+        with self.lock:
+            return [row[0] for row in self.connection.execute('SELECT path FROM pages ORDER BY rowid')]
+
+    def withoutContent(self):
+        '''
+        Returns the paths of stored pages that were indexed without their content, without loading their data
+        :params: none
+        :return: set of page paths
+        '''
+        with self.lock:
+            try:
+                rows = self.connection.execute("SELECT path FROM pages WHERE json_type(data, '$.result.content') IS NULL")
+                return {row[0] for row in rows}
+            except sqlite3.OperationalError:
+                # SQLite built without the JSON functions
+                rows = self.connection.execute('SELECT path, data FROM pages').fetchall()
+        return {path for path, data in rows if 'content' not in json.loads(data)['result']}
+
+    def get(self, path):
+        '''
+        Loads a single stored page
+        :params: path (str) - Telegraph page path
+        :return: JSON data for the page or None if it is not stored
+        '''
+        with self.lock:
+            row = self.connection.execute('SELECT data FROM pages WHERE path = ?', (path,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def add(self, pages):
+        '''
+        Writes pages to the store in a single transaction, replacing stored pages with the same path
+        :params: pages (iterable) - JSON data for telegraph pages
+        :return: number of written pages
+        '''
+        pages = list(pages)
+        if not pages:
+            return 0
+        rows = [(page['result']['path'], json.dumps(page, ensure_ascii=False)) for page in pages]
+        with self.lock:
+            with self.transaction():
+                # an upsert keeps the rowid of a stored page, which the search index refers to
+                self.connection.executemany('INSERT INTO pages (path, data) VALUES (?, ?) '
+                                            'ON CONFLICT(path) DO UPDATE SET data = excluded.data', rows)
+                if self.fts:
+                    self.connection.executemany(
+                        'INSERT OR REPLACE INTO pages_fts (rowid, path, title, text) '
+                        'VALUES ((SELECT rowid FROM pages WHERE path = ?), ?, ?, ?)',
+                        (searchRow(page) for page in pages)
+                    )
+        return len(rows)
+
+    def buildSearchIndex(self, batch_size=1000):
+        '''
+        Rebuilds the full-text index from all stored pages, used once for stores written before the index existed
+        :params: batch_size (int) - pages indexed per statement
+        :return: none
+        '''
+        with self.lock:
+            count = self.connection.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+            if count:
+                logging.info(f'Building search index of {self.path} ({count} pages)...')
+            with self.transaction():
+                self.connection.execute('DELETE FROM pages_fts')
+                cursor = self.connection.execute('SELECT data FROM pages')
+                while True:
+                    batch = cursor.fetchmany(batch_size)
+                    if not batch:
+                        break
+                    self.connection.executemany(
+                        'INSERT INTO pages_fts (rowid, path, title, text) '
+                        'VALUES ((SELECT rowid FROM pages WHERE path = ?), ?, ?, ?)',
+                        [searchRow(json.loads(row[0])) for row in batch]
+                    )
+                self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('fts', '1')")
+
+    def search(self, terms, limit=20):
+        '''
+        Finds stored pages matching a full-text query, best matches first. Title matches weigh more than text matches
+        :params: terms (str) - FTS5 query, input that is not valid FTS5 syntax is matched word by word;
+                 limit (int) - maximum number of results
+        :return: list of dicts with 'path', 'url', 'title', 'score' (lower is better) and 'snippet'
+        '''
+        if not self.fts:
+            raise RuntimeError(f'SQLite was built without FTS5, cannot search {self.path}')
+        sql = ('SELECT pages_fts.path, bm25(pages_fts, 0.0, 10.0, 1.0) AS score, '
+               "snippet(pages_fts, 2, '[', ']', '...', 12), pages.data "
+               'FROM pages_fts JOIN pages ON pages.rowid = pages_fts.rowid '
+               'WHERE pages_fts MATCH ? ORDER BY score LIMIT ?')
+        with self.lock:
+            try:
+                rows = self.connection.execute(sql, (terms, limit)).fetchall()
+            except sqlite3.OperationalError:
+                # not valid FTS5 syntax, match the words literally
+                quoted = ' '.join('"' + word.replace('"', '""') + '"' for word in terms.split())
+                rows = self.connection.execute(sql, (quoted, limit)).fetchall() if quoted else []
+        results = []
+        for path, score, snippet, data in rows:
+            result = json.loads(data)['result']
+            results.append({'path': path, 'url': result.get('url'), 'title': result.get('title'),
+                            'score': score, 'snippet': snippet})
+        return results
+
+    def getHighWaterMarks(self):
+        '''
+        Reads the highest page index already seen for each MM-DD date
+        :params: none
+        :return: dict of {'MM-DD': index}
+        '''
+        with self.lock:
+            return dict(self.connection.execute('SELECT date, high FROM dates'))
+
+    def setHighWaterMarks(self, marks):
+        '''
+        Raises the stored high-water marks to the given values, never lowering them
+        :params: marks (dict) - {'MM-DD': index}
+        :return: none
+        '''
+        with self.lock:
+            with self.transaction():
+                self.connection.executemany(
+                    'INSERT INTO dates (date, high) VALUES (?, ?) '
+                    'ON CONFLICT(date) DO UPDATE SET high = MAX(high, excluded.high)',
+                    marks.items()
+                )
+
+    def getMisses(self):
+        '''
+        Reads the negative cache: slugs that were probed and did not exist
+        :params: none
+        :return: dict of {slug: unix time of the probe}
+        '''
+        with self.lock:
+            return dict(self.connection.execute('SELECT slug, checked_at FROM misses'))
+
+    def setMisses(self, misses):
+        '''
+        Replaces the negative cache
+        :params: misses (dict) - {slug: unix time of the probe}
+        :return: none
+        '''
+        with self.lock:
+            with self.transaction():
+                self.connection.execute('DELETE FROM misses')
+                self.connection.executemany('INSERT INTO misses (slug, checked_at) VALUES (?, ?)', misses.items())
+
+    def getMeta(self, key, default=None):
+        '''
+        Reads a value from the store metadata
+        :params: key (str) - metadata key; default - value returned when the key is missing
+        :return: stored string value or default
+        '''
+        with self.lock:
+            row = self.connection.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+
+    def setMeta(self, key, value):
+        '''
+        Writes a value to the store metadata
+        :params: key (str) - metadata key; value (str) - value to store
+        :return: none
+        '''
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def transaction(self):
+        '''
+        Returns a context manager wrapping statements into one transaction
+        :params: none
+        :return: context manager
+        '''
+        return Transaction(self.connection)
+
+    def importLegacy(self, legacy_path):
+        '''
+        Moves pages from an old single JSON cache file into the store and renames the file
+        :params: legacy_path (str) - path to the "<query>_cache_store" JSON file
+        :return: none
+        '''
+        if not os.path.exists(legacy_path):
+            return
+        try:
+            with open(legacy_path, 'r', encoding='utf-8') as f:
+                legacy = json.load(f)
+            self.add(legacy.get('pagelist', []))
+            if legacy.get('date'):
+                self.setMeta('date', legacy['date'])
+            os.replace(legacy_path, legacy_path + '.migrated')
+            logging.info(f'Imported legacy cache from: {legacy_path}')
+        except Exception as ex:
+            logging.error(f'Error while importing legacy cache {legacy_path}: {ex}')
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def searchRow(page):
+    '''
+    Builds the full-text index row of a page with the text extraction used by the text output
+    :params: page (dict) - JSON data for a telegraph page
+    :return: (path, path, title, text) parameters of the index statements
+    '''
+    result = page['result']
+    text = '\n'.join(extractContent(result['content'])['text']) if 'content' in result else ''
+    return result['path'], result['path'], result.get('title') or '', text
+
+
+class Transaction(object):
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute('BEGIN')
+        return self.connection
+
+    def __exit__(self, exc_type, exc, tb):
+        self.connection.execute('ROLLBACK' if exc_type else 'COMMIT')
+
+
+class PageList(object):
+    '''
+    List-like view over the pages of a query. Stored pages are referenced by path and
+    loaded from the store only when they are accessed; new pages are kept in memory
+    until they are written
+    '''
+    def __init__(self, store, items=None):
+        self.store = store
+        self.lock = threading.RLock()
+        self.items = list(items) if items is not None else []
+        self.seen = {item if isinstance(item, str) else item['result']['path'] for item in self.items}
+        self.fresh = sum(1 for item in self.items if not isinstance(item, str))
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        for item in self.items:
+            yield self.load(item)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return PageList(self.store, self.items[key])
+        return self.load(self.items[key])
+
+    def load(self, item):
+        return self.store.get(item) if isinstance(item, str) else item
+
+    def append(self, page, stored=False):
+        '''
+        Adds a page unless a page with the same path is already listed
+        :params: page (dict) - JSON data for a telegraph page; stored (bool) - the page is already written
+                 to the store and is listed by path only
+        :return: none
+        '''
+        path = page['result']['path']
+        with self.lock:
+            if path not in self.seen:
+                self.seen.add(path)
+                if stored:
+                    self.items.append(path)
+                else:
+                    self.items.append(page)
+                    self.fresh += 1
+
+    def paths(self):
+        with self.lock:
+            return [item if isinstance(item, str) else item['result']['path'] for item in self.items]
+
+    def retain(self, paths):
+        '''
+        Keeps only the listed pages, in one pass (the store is left untouched)
+        :params: paths (set) - paths of the pages to keep
+        :return: none
+        '''
+        with self.lock:
+            self.items = [item for item in self.items
+                          if (item if isinstance(item, str) else item['result']['path']) in paths]
+            self.seen &= paths
+            self.fresh = sum(1 for item in self.items if not isinstance(item, str))
+
+    def unsaved(self):
+        '''
+        Returns pages that were added in memory and are not written to the store yet
+        :params: none
+        :return: list of JSON data for telegraph pages
+        '''
+        return [item for item in self.items if not isinstance(item, str)]
+
+    def markSaved(self):
+        '''
+        Replaces in-memory pages with references to their stored copies
+        :params: none
+        :return: none
+        '''
+        with self.lock:
+            self.items = [item if isinstance(item, str) else item['result']['path'] for item in self.items]
+            self.fresh = 0
+
+    def flush(self):
+        '''
+        Writes in-memory pages to the store and drops them from memory, keeping only their paths
+        :params: none
+        :return: number of written pages
+        '''
+        with self.lock:
+            written = self.store.add(self.unsaved())
+            self.markSaved()
+        return written
@@ -1,464 +1,1247 @@
-import argparse
-import concurrent.futures
-import os
-import requests
-import json
-import logging
-import re
-
-from datetime import datetime, timedelta
-from tqdm import tqdm
-
-from . import extra
-
-logging.basicConfig(
-    level=logging.INFO,
-    filename=os.path.join(os.path.dirname(__file__), 'scraper.log'),
-    format='%(asctime)s [%(levelname)s] - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S',
-)
-
-class Scraper(object):
-    def __init__(self, query):
-        logging.info(f'Initialization...')
-        self.formated_query = self.formatQuery(query)
-        self.session = requests.Session()
-        self.cache_file = self.formated_query + '_cache_store'
-        self.cache_path = os.path.join(os.path.dirname(__file__), 'cache', self.cache_file)
-        self.currentdate = datetime.now()
-        self.headers = extra.visitinfo
-        root = os.getcwd()
-        self.query_path = os.path.join(root, self.formated_query)
-        if not os.path.exists(self.query_path):
-            os.makedirs(self.query_path)
-        os.chdir(self.query_path)
-        logging.info(f'Initialized scraper for query: {query}')
-    
-    def formatQuery(self, query):
-        '''
-        Replaces non-Latin characters with '-' and cleans up extra '-' symbols
-        :param query: The input query string.
-        :return: The cleaned query string.
-        '''
-        # Replace non-Latin characters with '-'
-        cleaned_query = re.sub(r'[^a-zA-Z0-9]', '-', query)
-        # Replace multiple '-' with a single '-'
-        cleaned_query = re.sub(r'[-]+', '-', cleaned_query)
-        # Remove '-' from the start and end of the query
-        cleaned_query = cleaned_query.strip('-')
-        return cleaned_query
-
-    def getCache(self):
-        '''
-        Loads cached data from the cache file or initializes an empty cache if none is found
-        :params: none
-        :return: none
-        '''
-        try:
-            with open(self.cache_path, 'r', encoding='utf-8') as f:
-                f.seek(0)
-                self.cache = json.load(f)
-            logging.info(f'Loaded cached data from: {self.cache_path}')
-        except Exception as ex:
-            self.cache = {}
-            logging.info(f'Loaded empty cache. Exception: {ex}')
-        self.newQuery()
-
-    def updateCache(self):
-        '''
-        Updates the cache with the current page list and date and writes it to the cache file
-        :params: none
-        :return: none
-        '''
-        self.cache = {
-            'pagelist':self.pagelist[:],
-            'date':self.currentdate
-        }
-
-        cache_dir = os.path.dirname(self.cache_path)
-        if not os.path.exists(cache_dir):
-            os.makedirs(cache_dir)
-
-        with open(self.cache_path, 'w', encoding='utf-8') as f:
-            json.dump(self.cache, f, ensure_ascii=False, indent=4, default=str)
-        logging.info(f'Updated cache at: {self.cache_path}')
-    
-    def newQuery(self):
-        '''
-        Sets up the start and end dates for the query and initializes an empty or cached page list
-        :params: none
-        :return: none
-        '''
-        if self.cache:
-            self.start_date = datetime.fromisoformat(self.cache['date'])
-            self.end_date = self.currentdate
-            self.pagelist = self.cache['pagelist'][:]
-        else:
-            self.start_date = datetime(2000, 1, 1) #leap year
-            self.end_date = self.start_date + timedelta(366)
-            self.pagelist = []
-
-
-    def indexQuery(self, workers):
-        '''
-        Iterates through a range of dates to fetch pages using the search query, appending valid pages to the pagelist
-        :params: none
-        :return: none
-        '''
-        delta = self.end_date - self.start_date
-
-        logging.info(f'Indexing "{self.formated_query}" pages...')
-        self.outer_pbar = tqdm(
-                total=delta.days,
-                desc=f'Indexing "{self.formated_query}" pages',
-                unit=' page',
-                # position=0,
-                leave=False
-        )
-
-        def fetch_page(start_date):
-            index = 1
-            while True:
-                formatted_date = start_date.strftime('%m-%d')
-                search_query = [self.formated_query, formatted_date]
-
-                if index > 1:
-                    search_query.append(str(index))
-
-                try:
-                    data = self.getJSON('-'.join(search_query))
-                    if data['ok']:
-                        self.pagelist.append(data)
-                        index += 1
-                    else:
-                        self.outer_pbar.update()
-                        break
-                except Exception as ex:
-                    logging.error(f'Error at {search_query}: {ex}')
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
-            dates_range = [self.start_date + timedelta(days=i) for i in range(delta.days)]
-            list(executor.map(fetch_page, dates_range))
-
-        logging.info(f'Successfully fetched pages list for "{self.formated_query}"')
-        self.outer_pbar.close()
-
-    def getJSON(self, search_query):
-        '''
-        Sends an HTTP request to the Telegraph API to fetch page data for a given search query
-        :params: search_query (str) - The search query for a single page
-        :return: JSON response from the API
-        '''
-        try:
-            result = self.session.get(
-                f'https://api.telegra.ph/getPage/{search_query}?return_content=true',
-                headers=self.headers
-            ).json()
-        except Exception as ex:
-            logging.error(f'Error while processing {search_query}: {ex}')
-            result = None
-        return result
-
-    def getImages(self):
-        '''
-        Downloads images from indexed pages and stores them in corresponding directories
-        :params: none
-        :return: none
-        '''
-        self.outer_pbar = tqdm(
-                total=len(self.pagelist),
-                desc=f'Scrapping images from "{self.formated_query}" pages',
-                unit=' page',
-                # position=0,
-                leave=True
-            )
-        
-        logging.info(f'Scrapping images from "{self.formated_query}" pages...')
-
-        for page in self.pagelist:
-            page_name = page['result']['path']
-            page_path = os.path.join(self.query_path, page_name)
-            if not os.path.exists(page_path):
-                os.makedirs(page_path)
-            os.chdir(page_path)
-
-            try:
-                self.getImageList(page)
-            except Exception as ex:
-                logging.error(f'Error while processing page "{page_name}": {ex}')
-
-            self.inner_pbar = tqdm(
-                total=len(self.imagelist),
-                desc=f'Downloading images from "{page_name}" page',
-                unit=' image',
-                # position=1,
-                leave=False
-            )
-            for index, file in enumerate(self.imagelist, start=1):
-                try:
-                    with open(f'{index}.jpg', 'wb') as f:
-                        image_url = f'https://telegra.ph/file/{file}'
-                        image_response = requests.get(
-                            image_url,
-                            stream=True,
-                            headers=self.headers
-                        )
-                        f.write(image_response.content)
-                except requests.RequestException as ex:
-                    logging.error(f'Error downloading image {file}: {ex}')
-                except Exception as ex:
-                    logging.error(f'Error while processing image {file}: {ex}')
-                self.inner_pbar.update()
-            self.inner_pbar.close()
-
-            self.outer_pbar.update()
-        self.outer_pbar.close()
-        logging.info(f'Successfully scraped images for "{self.formated_query}"')
-            
-    
-    def getImageList(self, page):
-        '''
-        Extracts image URLs from the content of a given page and populates the imagelist
-        :params: page (dict) - JSON data for a telegraph page
-        :return: None
-        '''
-        content = page['result']['content']
-        self.imagelist = [sub_tag['attrs']['src'][6:]
-                        for item in content
-                        if isinstance(item, dict) and item['tag'] == 'figure'
-                        for sub_tag in item['children']
-                        if sub_tag['tag'] == 'img']
-
-    def getText(self):
-        '''
-        Gathers all text content from indexed pages and saves it into text files
-        :params: none
-        :return: none
-        '''
-        self.outer_pbar = tqdm(
-                total=len(self.pagelist),
-                desc=f'Scrapping text from "{self.formated_query}" pages',
-                unit=' page',
-                # position=0,
-                leave=True
-            )
-        
-        logging.info(f'Scrapping text from "{self.formated_query}" pages...')
-
-        for page in self.pagelist:
-            page_name = page['result']['path']
-            page_path = os.path.join(self.query_path, page_name)
-            if not os.path.exists(page_path):
-                os.makedirs(page_path)
-            os.chdir(page_path)
-            
-            try:
-                self.getTextList(page)
-            except Exception as ex:
-                logging.error(f'Error while processing page "{page_name}": {ex}')
-
-            self.textlist = list(filter(None, self.textlist)) #filter empty values from textlist
-            if self.textlist:
-                with open('text.txt', 'w', encoding='utf-8') as f:
-                    for line in self.textlist:
-                        f.write(f'{line}\n')
-
-            self.outer_pbar.update()
-        self.outer_pbar.close()
-        logging.info(f'Successfully scraped text for "{self.formated_query}"')
-
-    def getTextList(self, page):
-        '''
-        Collects all text from a given page and stores it in the textlist
-        :params: page (dict) - JSON data for a telegraph page.
-        :return: None
-        '''
-        content = page['result']['content']
-        self.textlist = [child.replace('\n', ' ').strip()
-                        for item in content
-                        if 'tag' in item and item['tag'] == 'p'
-                        for child in item.get('children', [])
-                        if isinstance(child, str)]
-    
-    def getLinks(self):
-        '''
-        Gathers all links from indexed pages and saves them into a text file
-        :params: page (dict) - JSON data for a telegraph page.
-        :return: none
-        '''
-        self.outer_pbar = tqdm(
-                total=len(self.pagelist),
-                desc=f'Scrapping links from "{self.formated_query}" pages',
-                unit=' page',
-                #position=0,
-                leave=True
-            )
-        
-        logging.info(f'Scrapping links from "{self.formated_query}" pages..."')
-
-        for page in self.pagelist:
-            page_name = page['result']['path']
-            page_path = os.path.join(self.query_path, page_name)
-            if not os.path.exists(page_path):
-                os.makedirs(page_path)
-            os.chdir(page_path)
-            
-            try:
-                self.getLinksList(page)
-            except Exception as ex:
-                logging.error(f'Error while processing page "{page_name}": {ex}')
-
-            if self.linklist:
-                with open('links.txt', 'w', encoding='utf-8') as f:
-                    for line in self.linklist:
-                        f.write(f'{line}\n')
-
-            self.outer_pbar.update()
-        self.outer_pbar.close()
-        logging.info(f'Successfully scraped links for "{self.formated_query}"')
-
-    def getLinksList(self, page):
-        '''
-        Collects all links from a given page and stores them in the linklist
-        :params: page (dict) - JSON data for a telegraph page.
-        :return: none
-        '''
-        content = page['result']['content']
-        self.linklist = [link['attrs']['href']
-                        for item in content
-                        if 'children' in item
-                        for child in item['children']
-                        if isinstance(child, dict) and child['tag'] == 'a'
-                        for link in [child]]
-
-
-    def getPagesUrl(self):
-        '''
-        Collects and stores the URLs of all indexed pages in a text file
-        :params: none
-        :return: none
-        '''
-        links = [page['result']['url'] for page in self.pagelist]
-        os.chdir(self.query_path)
-        with open(f'{self.formated_query}.txt', 'w') as f:
-            for link in links:
-                f.write(f'{link}\n')
-
-    def filterSpam(self):
-        '''
-        Filters out pages with authors in a predefined spam list from the pagelist
-        :params: none
-        :return: none
-        '''
-        for page in self.pagelist[:]:
-            author_name = page.get('result', {}).get('author_name')
-            if author_name is not None and author_name in extra.spam:
-                self.pagelist.remove(page)
-        logging.info(f'Filtered out spam pages')
-
-    def filterText(self, min_length, max_length):
-        '''
-        Filters pages based on text length criteria, removing pages falling outside the specified range
-        :params: min_length (int, optional) - Minimum text length; max_length (int, optional) - Maximum text length.
-        :return: none
-        '''
-        for page in self.pagelist[:]:
-            self.getTextList(page)
-            length = sum(len(string) for string in self.textlist)
-            if min_length is not None and length < min_length:
-                self.pagelist.remove(page)
-            elif max_length is not None and length > max_length:
-                self.pagelist.remove(page)
-        logging.info(f'Filtered out pages based on text length criteria')
-
-def parser():
-    '''
-    Returns the parser arguments
-    :params: none
-    :return: parser.parse_args() object
-    '''
-    parser = argparse.ArgumentParser(
-        description='Scrapes a telegraph pages from a specified search query'
-    )
-    main_grp = parser.add_argument_group('Main parameters')
-    main_grp.add_argument('QUERY', help = 'Single query given as a positional argument', type=str, nargs = '?')
-    main_grp.add_argument('-i', '--input-file', help = '<INPUT_FILE> text file (each query separated by new line) containing the target list. Ex: list.txt')
-    main_grp.add_argument('-o', '--output-directory', help = '<OUTPUT_DIRECTORY> (optional): query output directory (default "./Scraper results/")',
-                          default=os.path.join(os.getcwd(), 'Scraper results'))
-    main_grp.add_argument('-w', '--workers', help = '<WORKERS> (optional): number of parallel execution workers (default 4)', type=int, default = 4)
-
-    output_grp = parser.add_argument_group('Output parameters')
-    output_grp.add_argument('-I', '--images', action='store_true', help = 'collect all images on indexed pages')
-    output_grp.add_argument('-T', '--text', action='store_true', help='collect all text on indexed pages')
-    output_grp.add_argument('-L', '--links', action='store_true', help = 'collect all links on indexed pages')
-    output_grp.add_argument('-max', help='<MAX> (optional): Filter pages with text length greater than defined value.', type=int, nargs='?')
-    output_grp.add_argument('-min', help='<MIN> (optional): Filter pages with text length less than defined value.', type=int, nargs='?')
-
-    return parser.parse_args()
-
-def deleteEmptyFolders(directory):
-    '''
-    Recursively delete empty folders starting from the given directory.
-    :params: The directory to start searching for empty folders.
-    :return: none
-    '''
-    logging.info(f'Deleting empty folders...')
-
-    for root, dirs, files in os.walk(directory, topdown=False):
-        for dir_name in dirs:
-            folder_path = os.path.join(root, dir_name)
-            if not os.listdir(folder_path):
-                os.rmdir(folder_path)
-
-def main():
-    args = parser()
-    
-    if args.input_file != None:
-        with open(args.input_file,'rb') as file:
-            try:
-                input_list = [l.decode('utf-8').strip() for l in file.readlines()]
-            
-            except UnicodeDecodeError as e:
-                print('Your input file is not UTF-8 encoded, please encode it before using this script')
-    else:
-        input_list = [args.QUERY]
-    
-    for query in input_list:
-
-        if args.output_directory:
-            args.output_directory = os.path.join(os.getcwd(), args.output_directory)
-            if not os.path.exists(args.output_directory):
-                os.makedirs(args.output_directory)
-            os.chdir(args.output_directory)
-
-        scraper = Scraper(query)
-        scraper.getCache()
-        scraper.indexQuery(args.workers)
-        scraper.updateCache()
-        scraper.filterSpam()
-
-        if args.min or args.max:
-            scraper.filterText(args.min, args.max)
-            os.chdir(args.output_directory)
-
-        if args.images:
-            scraper.getImages()
-            os.chdir(args.output_directory)
-        
-        if args.text:
-            scraper.getText()
-            os.chdir(args.output_directory)
-        
-        if args.links:
-            scraper.getLinks()
-            os.chdir(args.output_directory)
-                
-        if not (args.images or args.text or args.links):
-            scraper.getPagesUrl()
-    
-    deleteEmptyFolders(args.output_directory)
-
-    logging.info(f'Done')
-
-if __name__ == '__main__':
-    main()
\ No newline at end of file
+import argparse
+import concurrent.futures
+import os
+import logging
+import re
+import sys
+import threading
+import time
+
+from datetime import datetime, timedelta
+
+from . import extra
+from .blobs import BlobStore
+from .dedup import FingerprintStore
+from .downloader import ImageDownloader
+from .export import FORMATS, openExporter
+from .extract import extractContent, imageFile
+from .filters import applyFilters, dateWindow, imageCount, minViews, nearDuplicates, spamAuthors, textLength, titleMatches
+from .journal import DownloadJournal
+from .metrics import metrics, requestOutcome, timed
+from .ratelimit import RateLimiter
+from .scheduler import CONTENT, IMAGE, INDEX, WRITE, Scheduler
+from .store import PageList, PageStore
+
+LOG_FILE = os.path.join(os.path.dirname(__file__), 'scraper.log')
+
+def setupLogging(path=LOG_FILE):
+    '''
+    Sends log records to the log file. Called by the command line entry points rather than on import,
+    and the file is only opened once the first record is written
+    :params: path (str) - log file
+    :return: none
+    '''
+    logging.basicConfig(
+        level=logging.INFO,
+        handlers=[logging.FileHandler(path, encoding='utf-8', delay=True)],
+        format='%(asctime)s [%(levelname)s] - %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+    )
+
+def progressBar(*args, **kwargs):
+    '''
+    Creates a tqdm progress bar, importing tqdm on first use
+    '''
+    from tqdm import tqdm
+
+    return tqdm(*args, **kwargs)
+
+class Scraper(object):
+    api_url = 'https://api.telegra.ph'
+    file_url = 'https://telegra.ph/file/'
+    # pages kept in memory before they are written to the page store
+    flush_size = 500
+
+    def __init__(self, query, output_directory=None, progress=True, limiter=None, transport=None):
+        '''
+        :params: query (str) - search query; output_directory (str, optional) - directory for query results
+                 (default: current directory); progress (bool) - show progress bars;
+                 limiter (RateLimiter, optional) - request layer for API calls;
+                 transport (Transport, optional) - HTTP transport, defaults to the one shared by the process
+        '''
+        logging.info(f'Initialization...')
+        self.formated_query = self.formatQuery(query)
+        if transport is None:
+            from .transport import Transport
+
+            transport = Transport.shared()
+        self.transport = transport
+        self.session = self.transport.session
+        self.cache_file = self.formated_query + '_cache_store'
+        self.legacy_cache_path = os.path.join(os.path.dirname(__file__), 'cache', self.cache_file)
+        self.cache_path = self.legacy_cache_path + '.sqlite'
+        self.blobs_path = os.path.join(os.path.dirname(__file__), 'cache', 'blobs')
+        self.fingerprints_path = os.path.join(os.path.dirname(__file__), 'cache', 'fingerprints.sqlite')
+        self.fingerprints = None
+        self.currentdate = datetime.now()
+        self.headers = extra.visitinfo
+        self.extractions = {}
+        self.limiter = limiter or RateLimiter()
+        self.progress = progress
+        root = os.path.abspath(output_directory or os.getcwd())
+        self.query_path = os.path.join(root, self.formated_query)
+        if not os.path.exists(self.query_path):
+            os.makedirs(self.query_path)
+        logging.info(f'Initialized scraper for query: {query}')
+    
+    @staticmethod
+    def formatQuery(query):
+        '''
+        Replaces non-Latin characters with '-' and cleans up extra '-' symbols
+        :param query: The input query string.
+        :return: The cleaned query string.
+        '''
+        # Replace non-Latin characters with '-'
+        cleaned_query = re.sub(r'[^a-zA-Z0-9]', '-', query)
+        # Replace multiple '-' with a single '-'
+        cleaned_query = re.sub(r'[-]+', '-', cleaned_query)
+        # Remove '-' from the start and end of the query
+        cleaned_query = cleaned_query.strip('-')
+        return cleaned_query
+
+    def getFingerprints(self):
+        '''
+        Opens the fingerprint store shared by all queries on first use
+        :params: none
+        :return: FingerprintStore
+        '''
+        if self.fingerprints is None:
+            self.fingerprints = FingerprintStore(self.fingerprints_path)
+        return self.fingerprints
+
+    def getCache(self):
+        '''
+        Opens the page store of the query, importing an old JSON cache file if one is found
+        :params: none
+        :return: none
+        '''
+        self.cache = PageStore(self.cache_path)
+        self.cache.importLegacy(self.legacy_cache_path)
+        logging.info(f'Loaded page store from: {self.cache_path} ({len(self.cache)} pages)')
+        self.newQuery()
+
+    @timed('write')
+    def updateCache(self):
+        '''
+        Writes pages found by this run, the per-date high-water marks, the negative cache and the current date to the page store
+        :params: none
+        :return: none
+        '''
+        written = self.pagelist.flush()
+        self.cache.setHighWaterMarks(self.marks)
+        # keep only the entries for the next unseen slug of every date
+        next_slugs = {self.slug(date, index + 1) for date, index in self.marks.items()}
+        next_slugs.update(self.slug(date.strftime('%m-%d'), 1) for date in self.dates)
+        self.cache.setMisses({slug: checked_at for slug, checked_at in self.misses.items() if slug in next_slugs})
+        self.cache.setMeta('date', self.currentdate.isoformat())
+        logging.info(f'Updated page store at: {self.cache_path} ({written} new pages)')
+    
+    def newQuery(self):
+        '''
+        Sets up the dates to index with the highest page index already seen for each of them and the
+        negative cache, and initializes the page list with cached pages
+        :params: none
+        :return: none
+        '''
+        start_date = datetime(2000, 1, 1) #leap year
+        self.dates = [start_date + timedelta(days=i) for i in range(366)]
+        paths = self.cache.paths()
+        self.marks = self.cache.getHighWaterMarks() or self.highWaterMarks(paths)
+        self.misses = self.cache.getMisses()
+        self.pagelist = PageList(self.cache, paths)
+
+    def highWaterMarks(self, paths):
+        '''
+        Derives the highest page index per MM-DD date from page paths
+        :params: paths (list) - Telegraph page paths, ex. "query-01-31" or "query-01-31-5"
+        :return: dict of {'MM-DD': index}
+        '''
+        marks = {}
+        for path in paths:
+            match = re.search(r'-(\d{2}-\d{2})(?:-(\d+))?$', path)
+            if match:
+                date, index = match.group(1), int(match.group(2) or 1)
+                marks[date] = max(marks.get(date, 0), index)
+        return marks
+
+    def addPage(self, page):
+        '''
+        Adds an indexed page to the pagelist, writing pending pages to the page store every `flush_size` pages
+        :params: page (dict) - JSON data for a telegraph page
+        :return: none
+        '''
+        self.pagelist.append(page)
+        if self.pagelist.fresh >= self.flush_size:
+            self.pagelist.flush()
+
+    def slug(self, formatted_date, index):
+        '''
+        Builds the Telegraph path of a page
+        :params: formatted_date (str) - MM-DD; index (int) - page index, 1 for the unsuffixed slug
+        :return: page path, ex. "query-01-31" or "query-01-31-5"
+        '''
+        search_query = [self.formated_query, formatted_date]
+        if index > 1:
+            search_query.append(str(index))
+        return '-'.join(search_query)
+
+    def isKnownMiss(self, date, ttl, decay=0):
+        '''
+        Checks the negative cache for the next unseen slug of a date. Pages can only be published on their
+        own MM-DD, so an entry expires no later than a day before the date comes round again (a day of margin
+        for time zones), and within that limit its TTL grows with the days since the date last occurred
+        :params: date (datetime) - the date to check; ttl (float) - TTL in seconds, 0 disables the cache;
+                 decay (float) - extra TTL, as a multiple of `ttl`, per day of age
+        :return: bool
+        '''
+        formatted_date = date.strftime('%m-%d')
+        checked_at = self.misses.get(self.slug(formatted_date, self.marks.get(formatted_date, 0) + 1))
+        if not ttl or checked_at is None:
+            return False
+        checked = datetime.fromtimestamp(checked_at)
+        upcoming = sameDay(date, checked.year)
+        if upcoming < checked - timedelta(days=1):
+            upcoming = sameDay(date, checked.year + 1)
+        previous = upcoming if upcoming <= checked else sameDay(date, upcoming.year - 1)
+        age = (checked - previous).days
+        expires = min(checked_at + ttl * (1 + decay * age), (upcoming - timedelta(days=1)).timestamp())
+        return time.time() < expires
+
+    def datesToIndex(self, miss_ttl=0, miss_decay=0):
+        '''
+        Returns the dates to probe, leaving out those whose next slug is an unexpired negative cache entry
+        :params: miss_ttl (float) - negative cache TTL in seconds, 0 probes every date;
+                 miss_decay (float) - extra negative cache TTL, as a multiple of miss_ttl, per day of the date's age
+        :return: list of datetime objects
+        '''
+        dates = []
+        for date in self.dates:
+            known_miss = self.isKnownMiss(date, miss_ttl, miss_decay)
+            metrics.inc('cache_lookups_total', cache='misses', result='hit' if known_miss else 'miss')
+            if not known_miss:
+                dates.append(date)
+        return dates
+
+    @timed('index')
+    def indexQuery(self, workers, engine='thread', per_host=None, lookahead=4, content=True, miss_ttl=0, miss_decay=0):
+        '''
+        Iterates through all dates of the year to fetch pages using the search query, appending valid pages to the pagelist.
+        Each date is probed starting right after the highest page index already seen for it, and dates whose
+        next slug is in the negative cache are skipped until the entry expires
+        :params: workers (int) - number of threads, or concurrent requests for the async engine;
+                 engine (str) - 'thread' or 'async'; per_host (int, optional) - async per-host connection limit;
+                 lookahead (int) - async index probes in flight per date;
+                 content (bool) - fetch page content while indexing, otherwise only metadata is fetched;
+                 miss_ttl (float) - negative cache TTL in seconds, 0 probes every date;
+                 miss_decay (float) - extra negative cache TTL, as a multiple of miss_ttl, per day of the date's age
+        :return: none
+        '''
+        dates = self.datesToIndex(miss_ttl, miss_decay)
+
+        logging.info(f'Indexing "{self.formated_query}" pages ({len(self.dates) - len(dates)} dates skipped as known misses)...')
+        self.outer_pbar = progressBar(
+                disable=not self.progress,
+                total=len(dates),
+                desc=f'Indexing "{self.formated_query}" pages',
+                unit=' page',
+                # position=0,
+                leave=False
+        )
+
+        def fetch_page(start_date):
+            formatted_date = start_date.strftime('%m-%d')
+            index = self.marks.get(formatted_date, 0) + 1
+            while True:
+                search_query = self.slug(formatted_date, index)
+                data = self.getJSON(search_query, content)
+                if data and data.get('ok'):
+                    self.addPage(data)
+                    self.marks[formatted_date] = index
+                    index += 1
+                else:
+                    # a miss, or a slug that kept failing: the next run resumes from the high-water mark
+                    if data is not None:
+                        self.misses[search_query] = time.time()
+                    self.outer_pbar.update()
+                    break
+
+        if engine == 'async':
+            from .asyncindex import AsyncIndexer
+
+            indexer = AsyncIndexer(self, workers, per_host=per_host, lookahead=lookahead, content=content)
+            indexer.run(dates)
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(fetch_page, dates))
+
+        logging.info(f'Successfully fetched pages list for "{self.formated_query}"')
+        self.outer_pbar.close()
+
+    def getJSON(self, search_query, content=True):
+        '''
+        Sends an HTTP request to the Telegraph API to fetch page data for a given search query,
+        retrying throttled and failed requests with backoff
+        :params: search_query (str) - The search query for a single page; content (bool) - include the page content
+        :return: JSON response from the API or None when all attempts failed
+        '''
+        for attempt in range(self.limiter.max_attempts):
+            status, result, retry_after = None, None, None
+            self.limiter.acquire()
+            started = time.monotonic()
+            try:
+                response = self.session.get(
+                    self.pageUrl(search_query, content),
+                    headers=self.headers
+                )
+                status, retry_after = response.status_code, response.headers.get('Retry-After')
+                result = response.json()
+            except Exception as ex:
+                logging.error(f'Error while processing {search_query}: {ex}')
+            finally:
+                latency = time.monotonic() - started
+                self.limiter.release(status, latency)
+                outcome = requestOutcome(status, result)
+                metrics.inc('api_requests_total', outcome=outcome)
+                metrics.observe('api_request_seconds', latency, outcome=outcome)
+
+            delay = self.limiter.retryDelay(attempt, status, result, retry_after)
+            if delay is None:
+                return result
+            time.sleep(delay)
+
+        logging.error(f'Giving up on {search_query} after {self.limiter.max_attempts} attempts')
+        return None
+
+    def pageUrl(self, search_query, content=True):
+        '''
+        Builds the Telegraph API getPage URL for a page path
+        :params: search_query (str) - The search query for a single page; content (bool) - include the page content
+        :return: URL string
+        '''
+        return f'{self.api_url}/getPage/{search_query}?return_content={"true" if content else "false"}'
+
+    @timed('content')
+    def fetchContent(self, workers, batch_size=500):
+        '''
+        Fetches content for listed pages that were indexed without it and writes them to the page store.
+        Only the paths of pending pages and one batch of fetched pages are held in memory. Pages whose content
+        cannot be fetched (deleted since indexing, or failing after all attempts) are dropped from the list
+        :params: workers (int) - number of parallel requests; batch_size (int) - pages written per store transaction
+        :return: none
+        '''
+        self.pagelist.flush()
+        missing = self.cache.withoutContent()
+        listed = self.pagelist.paths()
+        pending = [path for path in listed if path in missing]
+        if not pending:
+            return
+
+        logging.info(f'Fetching content of {len(pending)} "{self.formated_query}" pages...')
+        self.outer_pbar = progressBar(
+                disable=not self.progress,
+                total=len(pending),
+                desc=f'Fetching "{self.formated_query}" pages content',
+                unit=' page',
+                # position=0,
+                leave=False
+        )
+
+        failed = set()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            for i in range(0, len(pending), batch_size):
+                batch = pending[i:i + batch_size]
+                fetched = self.fetchBatch(executor, batch, self.outer_pbar)
+                failed.update(path for path in batch if path not in fetched)
+
+        if failed:
+            self.pagelist.retain(set(listed) - failed)
+            metrics.inc('pages_filtered_total', len(failed), filter='content')
+            logging.info(f'Filtered out {len(failed)} pages: content')
+        self.outer_pbar.close()
+        logging.info(f'Fetched content for "{self.formated_query}" pages')
+
+    def fetchBatch(self, executor, paths, progress=None):
+        '''
+        Fetches the content of a batch of pages and writes them to the page store
+        :params: executor (Executor) - pool running the requests; paths (list) - Telegraph page paths;
+                 progress (tqdm, optional) - updated per page
+        :return: dict of {path: JSON data} for the pages that were fetched
+        '''
+        def fetch_content(path):
+            data = self.getJSON(path)
+            if progress is not None:
+                progress.update()
+            if data and data.get('ok'):
+                return data
+            logging.error(f'Error while fetching content of "{path}"')
+            return None
+
+        fetched = [data for data in executor.map(fetch_content, paths) if data is not None]
+        self.cache.add(fetched)
+        return {data['result']['path']: data for data in fetched}
+
+    @timed('images')
+    def getImages(self, workers=4, max_bytes=64 * 1024 * 1024, max_bandwidth=None, revalidate=False):
+        '''
+        Downloads images from indexed pages and links them into corresponding directories.
+        Images of all pages are fetched by a shared pool of workers into the shared blob store,
+        files already in the store are not downloaded again. Finished outputs are recorded in a download journal,
+        so an interrupted run resumes where it stopped
+        :params: workers (int) - number of parallel downloads; max_bytes (int) - cap on bytes in flight;
+                 max_bandwidth (float, optional) - cap on bytes per second; revalidate (bool) - re-check finished outputs
+                 with conditional requests
+        :return: none
+        '''
+        self.outer_pbar = progressBar(
+                disable=not self.progress,
+                total=0,
+                desc=f'Scrapping images from "{self.formated_query}" pages',
+                unit=' image',
+                # position=0,
+                leave=True
+            )
+        
+        logging.info(f'Scrapping images from "{self.formated_query}" pages...')
+
+        self.transport.resize(workers)
+        blobs = BlobStore(self.blobs_path)
+        journal = DownloadJournal(os.path.join(self.query_path, '.download_journal'))
+        downloader = ImageDownloader(self.session, self.headers, self.file_url, blobs, journal, workers,
+                                     max_bytes=max_bytes, max_bandwidth=max_bandwidth, revalidate=revalidate)
+        try:
+            downloader.run(self.imageJobs(), self.outer_pbar)
+        finally:
+            journal.close()
+            blobs.close()
+
+        self.outer_pbar.close()
+        logging.info(f'Successfully scraped images for "{self.formated_query}"')
+
+    def imageJobs(self):
+        '''
+        Yields a download job for every image on every indexed page, creating page directories on the way
+        :params: none
+        :return: generator of (directory, index, file) tuples
+        '''
+        for page in self.pagelist:
+            jobs = self.pageImageJobs(page)
+            self.outer_pbar.total += len(jobs)
+            self.outer_pbar.refresh()
+            yield from jobs
+
+    def pageImageJobs(self, page):
+        '''
+        Returns the download jobs for the images of a page, creating the page directory
+        :params: page (dict) - JSON data for a telegraph page
+        :return: list of (directory, index, file) tuples
+        '''
+        page_name = page['result']['path']
+        page_path = os.path.join(self.query_path, page_name)
+        try:
+            imagelist = self.getImageList(page)
+        except Exception as ex:
+            logging.error(f'Error while processing page "{page_name}": {ex}')
+            return []
+
+        if not os.path.exists(page_path):
+            os.makedirs(page_path)
+        return [(page_path, index, file) for index, file in enumerate(imagelist, start=1)]
+
+    def getImageList(self, page):
+        '''
+        Extracts image URLs from the content of a given page
+        :params: page (dict) - JSON data for a telegraph page
+        :return: list of image file names
+        '''
+        return [imageFile(src) for src in self.extractPage(page)['images']]
+
+    def extractPage(self, page):
+        '''
+        Returns the extraction record of a page (images, text runs, links, text length, media),
+        walking the page content only the first time it is requested
+        :params: page (dict) - JSON data for a telegraph page
+        :return: dict produced by extract.extractContent
+        '''
+        path = page['result']['path']
+        record = self.extractions.get(path)
+        metrics.inc('cache_lookups_total', cache='extract', result='miss' if record is None else 'hit')
+        if record is None:
+            started = time.monotonic()
+            record = self.extractions[path] = extractContent(page['result']['content'])
+            metrics.inc('stage_seconds_total', time.monotonic() - started, stage='extract')
+        return record
+
+    @timed('write')
+    def getText(self):
+        '''
+        Gathers all text content from indexed pages and saves it into text files
+        :params: none
+        :return: none
+        '''
+        self.outer_pbar = progressBar(
+                disable=not self.progress,
+                total=len(self.pagelist),
+                desc=f'Scrapping text from "{self.formated_query}" pages',
+                unit=' page',
+                # position=0,
+                leave=True
+            )
+        
+        logging.info(f'Scrapping text from "{self.formated_query}" pages...')
+
+        for page in self.pagelist:
+            self.writeText(page)
+            self.outer_pbar.update()
+        self.outer_pbar.close()
+        logging.info(f'Successfully scraped text for "{self.formated_query}"')
+
+    def writeText(self, page):
+        '''
+        Saves the text of a page into its text file
+        :params: page (dict) - JSON data for a telegraph page
+        :return: none
+        '''
+        page_name = page['result']['path']
+        page_path = os.path.join(self.query_path, page_name)
+        if not os.path.exists(page_path):
+            os.makedirs(page_path)
+
+        textlist = []
+        try:
+            textlist = self.getTextList(page)
+        except Exception as ex:
+            logging.error(f'Error while processing page "{page_name}": {ex}')
+
+        textlist = list(filter(None, textlist)) #filter empty values from textlist
+        if textlist:
+            with open(os.path.join(page_path, 'text.txt'), 'w', encoding='utf-8') as f:
+                for line in textlist:
+                    f.write(f'{line}\n')
+
+    def getTextList(self, page):
+        '''
+        Collects all text from a given page
+        :params: page (dict) - JSON data for a telegraph page.
+        :return: list of text runs
+        '''
+        return self.extractPage(page)['text']
+    
+    @timed('write')
+    def getLinks(self):
+        '''
+        Gathers all links from indexed pages and saves them into a text file
+        :params: page (dict) - JSON data for a telegraph page.
+        :return: none
+        '''
+        self.outer_pbar = progressBar(
+                disable=not self.progress,
+                total=len(self.pagelist),
+                desc=f'Scrapping links from "{self.formated_query}" pages',
+                unit=' page',
+                #position=0,
+                leave=True
+            )
+        
+        logging.info(f'Scrapping links from "{self.formated_query}" pages..."')
+
+        for page in self.pagelist:
+            self.writeLinks(page)
+            self.outer_pbar.update()
+        self.outer_pbar.close()
+        logging.info(f'Successfully scraped links for "{self.formated_query}"')
+
+    def writeLinks(self, page):
+        '''
+        Saves the links of a page into its links file
+        :params: page (dict) - JSON data for a telegraph page
+        :return: none
+        '''
+        page_name = page['result']['path']
+        page_path = os.path.join(self.query_path, page_name)
+        if not os.path.exists(page_path):
+            os.makedirs(page_path)
+
+        linklist = []
+        try:
+            linklist = self.getLinksList(page)
+        except Exception as ex:
+            logging.error(f'Error while processing page "{page_name}": {ex}')
+
+        if linklist:
+            with open(os.path.join(page_path, 'links.txt'), 'w', encoding='utf-8') as f:
+                for line in linklist:
+                    f.write(f'{line}\n')
+
+    def getLinksList(self, page):
+        '''
+        Collects all links from a given page
+        :params: page (dict) - JSON data for a telegraph page.
+        :return: list of link URLs
+        '''
+        return self.extractPage(page)['links']
+
+
+    @timed('write')
+    def getPagesUrl(self):
+        '''
+        Collects and stores the URLs of all indexed pages in a text file
+        :params: none
+        :return: none
+        '''
+        links = [page['result']['url'] for page in self.pagelist]
+        with open(os.path.join(self.query_path, f'{self.formated_query}.txt'), 'w') as f:
+            for link in links:
+                f.write(f'{link}\n')
+
+    def pageRecord(self, page):
+        '''
+        Collects the exported fields of a page
+        :params: page (dict) - JSON data for a telegraph page
+        :return: dict with path, url, title, author, views, text, links and images (Telegraph file names)
+        '''
+        result = page['result']
+        record = self.extractPage(page) if 'content' in result else {'text': [], 'links': [], 'images': []}
+        return {
+            'path': result['path'],
+            'url': result.get('url'),
+            'title': result.get('title'),
+            'author': result.get('author_name'),
+            'views': result.get('views', 0),
+            'text': '\n'.join(record['text']),
+            'links': list(record['links']),
+            'images': [imageFile(src) for src in record['images']],
+        }
+
+    @timed('write')
+    def exportPages(self, fmt, batch_size=1000):
+        '''
+        Writes the fields of all pages into a single compressed file of the query
+        :params: fmt (str) - export format, one of export.FORMATS; batch_size (int) - records per compressed batch
+        :return: none
+        '''
+        self.outer_pbar = progressBar(
+                disable=not self.progress,
+                total=len(self.pagelist),
+                desc=f'Exporting "{self.formated_query}" pages',
+                unit=' page',
+                # position=0,
+                leave=True
+            )
+
+        logging.info(f'Exporting "{self.formated_query}" pages as {fmt}...')
+
+        exporter = openExporter(self.query_path, self.formated_query, fmt, batch_size)
+        try:
+            for page in self.pagelist:
+                exporter.write(self.pageRecord(page))
+                self.outer_pbar.update()
+        finally:
+            count = exporter.close()
+        self.outer_pbar.close()
+        logging.info(f'Exported {count} "{self.formated_query}" pages to {exporter.path}')
+
+    @timed('filter')
+    def filterPages(self, filters):
+        '''
+        Runs the pagelist through a filter pipeline in a single pass, keeping the pages that pass every filter
+        :params: filters (list) - (name, predicate) pairs, see filters.py
+        :return: none
+        '''
+        if not filters:
+            return
+        rejected = {}
+        kept = {page['result']['path'] for page in applyFilters(self.pagelist, filters, rejected)}
+        self.pagelist.retain(kept)
+        for name, count in rejected.items():
+            metrics.inc('pages_filtered_total', count, filter=name)
+            logging.info(f'Filtered out {count} pages: {name}')
+
+    def filterSpam(self):
+        '''
+        Filters out pages with authors in a predefined spam list from the pagelist
+        :params: none
+        :return: none
+        '''
+        self.filterPages([('spam', spamAuthors(extra.spam))])
+
+    def filterText(self, min_length, max_length):
+        '''
+        Filters pages based on text length criteria, removing pages falling outside the specified range
+        :params: min_length (int, optional) - Minimum text length; max_length (int, optional) - Maximum text length.
+        :return: none
+        '''
+        self.filterPages([('length', textLength(self.extractPage, min_length, max_length))])
+
+    @timed('stream')
+    def streamQuery(self, workers, filters=(), content_filters=(), images=False, text=False, links=False,
+                    max_bytes=64 * 1024 * 1024, max_bandwidth=None, revalidate=False, batch_size=500, export=None):
+        '''
+        Runs filtering, content fetching and the output stages in a single pass over the pagelist. Pages are
+        loaded and fetched one batch at a time and dropped as soon as every stage is done with them, so memory
+        stays flat no matter how many pages the query has
+        :params: workers (int) - number of parallel requests and downloads;
+                 filters (list) - (name, predicate) pairs on page metadata;
+                 content_filters (list) - (name, predicate) pairs that need page content;
+                 images, text, links (bool) - output stages to run, page URLs are written when none is selected;
+                 max_bytes (int) - cap on image bytes in flight; max_bandwidth (float, optional) - cap on image bytes
+                 per second; revalidate (bool) - re-check downloaded images;
+                 batch_size (int) - pages loaded and fetched at a time;
+                 export (str, optional) - export format, replaces the text, links and URL files
+        :return: none
+        '''
+        self.pagelist.flush()
+        self.outer_pbar = progressBar(
+                disable=not self.progress,
+                total=len(self.pagelist),
+                desc=f'Streaming "{self.formated_query}" pages',
+                unit=' page',
+                # position=0,
+                leave=True
+            )
+
+        logging.info(f'Streaming "{self.formated_query}" pages...')
+
+        self.transport.resize(workers)
+
+        needs_content = bool(content_filters) or images or text or links or bool(export)
+        content_filters = [('content', lambda page: 'content' in page['result'])] + list(content_filters)
+        rejected = {}
+        kept = set()
+        exporter = openExporter(self.query_path, self.formated_query, export) if export else None
+        text, links = text and not exporter, links and not exporter
+        urls = None if needs_content else open(os.path.join(self.query_path, f'{self.formated_query}.txt'), 'w')
+
+        def stream(executor):
+            for i in range(0, len(self.pagelist), batch_size):
+                before = sum(rejected.values())
+                batch = list(applyFilters(self.pagelist[i:i + batch_size], filters, rejected))
+                if needs_content:
+                    pending = [page['result']['path'] for page in batch if 'content' not in page['result']]
+                    fetched = self.fetchBatch(executor, pending) if pending else {}
+                    batch = applyFilters((fetched.get(page['result']['path'], page) for page in batch),
+                                         content_filters, rejected)
+                yield from batch
+                self.outer_pbar.update(sum(rejected.values()) - before)
+                for path in self.pagelist.items[i:i + batch_size]:
+                    self.extractions.pop(path, None)
+
+        def jobs(executor):
+            for page in stream(executor):
+                path = page['result']['path']
+                kept.add(path)
+                if urls is not None:
+                    urls.write(f'{page["result"]["url"]}\n')
+                if exporter is not None:
+                    exporter.write(self.pageRecord(page))
+                if text:
+                    self.writeText(page)
+                if links:
+                    self.writeLinks(page)
+                if images:
+                    yield from self.pageImageJobs(page)
+                self.outer_pbar.update()
+
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                if images:
+                    blobs = BlobStore(self.blobs_path)
+                    journal = DownloadJournal(os.path.join(self.query_path, '.download_journal'))
+                    downloader = ImageDownloader(self.session, self.headers, self.file_url, blobs, journal, workers,
+                                                 max_bytes=max_bytes, max_bandwidth=max_bandwidth, revalidate=revalidate)
+                    try:
+                        downloader.run(jobs(executor))
+                    finally:
+                        journal.close()
+                        blobs.close()
+                else:
+                    for _ in jobs(executor):
+                        pass
+        finally:
+            if urls is not None:
+                urls.close()
+            if exporter is not None:
+                exporter.close()
+
+        self.pagelist.retain(kept)
+        for name, count in rejected.items():
+            metrics.inc('pages_filtered_total', count, filter=name)
+            logging.info(f'Filtered out {count} pages: {name}')
+        self.outer_pbar.close()
+        logging.info(f'Successfully streamed {len(kept)} pages for "{self.formated_query}"')
+
+    @timed('schedule')
+    def scheduleQuery(self, workers, filters=(), content_filters=(), images=False, text=False, links=False,
+                      max_bytes=64 * 1024 * 1024, max_bandwidth=None, revalidate=False, export=None, max_pending=1000,
+                      miss_ttl=0, miss_decay=0):
+        '''
+        Runs indexing, content fetching, image downloads and output writes as overlapping tasks on one
+        prioritized scheduler instead of stage after stage. Work that finishes pages goes first. Content fetches
+        wait while `max_pending` pages are in flight, and new index probes also count the pages still waiting
+        for their content, so memory stays bounded
+        :params: workers (int) - worker threads shared by all stages;
+                 filters (list) - (name, predicate) pairs on page metadata;
+                 content_filters (list) - (name, predicate) pairs that need page content;
+                 images, text, links (bool) - output stages to run, page URLs are written when none is selected;
+                 max_bytes (int) - cap on image bytes in flight; max_bandwidth (float, optional) - cap on image bytes
+                 per second; revalidate (bool) - re-check downloaded images;
+                 export (str, optional) - export format, replaces the text, links and URL files;
+                 max_pending (int) - pages in flight before content fetches and index probes are held back;
+                 miss_ttl, miss_decay (float) - negative cache settings, see indexQuery
+        :return: none
+        '''
+        self.pagelist.flush()
+        self.transport.resize(workers)
+        self.outer_pbar = progressBar(
+                disable=not self.progress,
+                total=0,
+                desc=f'Scraping "{self.formated_query}" pages',
+                unit=' page',
+                # position=0,
+                leave=True
+            )
+
+        logging.info(f'Scheduling "{self.formated_query}" pages...')
+
+        needs_content = bool(content_filters) or images or text or links or bool(export)
+        exporter = openExporter(self.query_path, self.formated_query, export) if export else None
+        text, links = text and not exporter, links and not exporter
+        urls = None if needs_content else open(os.path.join(self.query_path, f'{self.formated_query}.txt'), 'w')
+        blobs = journal = downloader = None
+        if images:
+            blobs = BlobStore(self.blobs_path)
+            journal = DownloadJournal(os.path.join(self.query_path, '.download_journal'))
+            downloader = ImageDownloader(self.session, self.headers, self.file_url, blobs, journal, workers,
+                                         max_bytes=max_bytes, max_bandwidth=max_bandwidth, revalidate=revalidate)
+
+        lock = threading.Lock()
+        rejected = {}
+        kept = set()
+        # tasks left per page in flight, a page is in flight from the start of its content task
+        remaining = {}
+        # a content task adds its page right after it starts, so at most `workers` more pages can slip past the gate
+        scheduler = Scheduler(workers, limits={WRITE: 1}, gates={
+            CONTENT: lambda: len(remaining) < max_pending,
+            INDEX: lambda: len(remaining) + len(scheduler.queues[CONTENT]) < max_pending,
+        })
+
+        def passes(page, page_filters):
+            counts = {}
+            passed = any(True for _ in applyFilters([page], page_filters, counts))
+            with lock:
+                for name, count in counts.items():
+                    rejected[name] = rejected.get(name, 0) + count
+            return passed
+
+        def release(path):
+            with lock:
+                remaining[path] -= 1
+                if remaining[path]:
+                    return
+                del remaining[path]
+            self.extractions.pop(path, None)
+            self.outer_pbar.update()
+
+        def admit(path):
+            with lock:
+                self.outer_pbar.total += 1
+            self.outer_pbar.refresh()
+            scheduler.submit(CONTENT, fetch, path)
+
+        def probe(formatted_date, index):
+            search_query = self.slug(formatted_date, index)
+            data = self.getJSON(search_query, False)
+            if data and data.get('ok'):
+                self.marks[formatted_date] = index
+                scheduler.submit(WRITE, indexed, data)
+                scheduler.submit(INDEX, probe, formatted_date, index + 1)
+            elif data is not None:
+                self.misses[search_query] = time.time()
+
+        def indexed(data):
+            self.cache.add([data])
+            self.pagelist.append(data, stored=True)
+            admit(data['result']['path'])
+
+        def fetch(path):
+            with lock:
+                remaining[path] = 1
+            try:
+                page = self.cache.get(path)
+                if page is None or not passes(page, filters):
+                    return
+                store = needs_content and 'content' not in page['result']
+                if store:
+                    data = self.getJSON(path)
+                    if not (data and data.get('ok')):
+                        logging.error(f'Error while fetching content of "{path}"')
+                        with lock:
+                            rejected['content'] = rejected.get('content', 0) + 1
+                        return
+                    page = data
+                if needs_content and not passes(page, content_filters):
+                    return
+                kept.add(path)
+                jobs = self.pageImageJobs(page) if images else []
+                with lock:
+                    remaining[path] += 1 + len(jobs)
+                scheduler.submit(WRITE, output, page, store)
+                for job in jobs:
+                    scheduler.submit(IMAGE, download, path, job)
+            finally:
+                release(path)
+
+        def output(page, store):
+            try:
+                if store:
+                    self.cache.add([page])
+                if urls is not None:
+                    urls.write(f'{page["result"]["url"]}\n')
+                if exporter is not None:
+                    exporter.write(self.pageRecord(page))
+                if text:
+                    self.writeText(page)
+                if links:
+                    self.writeLinks(page)
+            finally:
+                release(page['result']['path'])
+
+        def download(path, job):
+            directory, index, file = job
+            try:
+                downloader.fetch(file, directory, index)
+            except Exception as ex:
+                metrics.inc('images_total', result='error')
+                logging.error(f'Error downloading image {file}: {ex}')
+            finally:
+                release(path)
+
+        for path in list(self.pagelist.items):
+            admit(path)
+        for date in self.datesToIndex(miss_ttl, miss_decay):
+            formatted_date = date.strftime('%m-%d')
+            scheduler.submit(INDEX, probe, formatted_date, self.marks.get(formatted_date, 0) + 1)
+
+        try:
+            scheduler.run()
+        finally:
+            if urls is not None:
+                urls.close()
+            if exporter is not None:
+                exporter.close()
+            if images:
+                journal.close()
+                blobs.close()
+
+        self.pagelist.retain(kept)
+        for name, count in rejected.items():
+            metrics.inc('pages_filtered_total', count, filter=name)
+            logging.info(f'Filtered out {count} pages: {name}')
+        self.outer_pbar.close()
+        logging.info(f'Successfully scraped {len(kept)} pages for "{self.formated_query}"')
+
+def sameDay(date, year):
+    '''
+    Returns midnight of the month and day of a date in another year, 02-29 falls back to 02-28 in other years
+    :params: date (datetime) - date whose month and day are used; year (int) - target year
+    :return: datetime
+    '''
+    try:
+        return datetime(year, date.month, date.day)
+    except ValueError:
+        return datetime(year, 2, 28)
+
+def monthDay(value):
+    '''
+    Parses a MM-DD date argument
+    :params: value (str) - command line value
+    :return: the value, if it is a MM-DD date
+    '''
+    if not re.match(r'^\d{2}-\d{2}$', value):
+        raise argparse.ArgumentTypeError(f'"{value}" is not a MM-DD date, ex. 01-05')
+    try:
+        # a leap year, so 02-29 is valid
+        datetime.strptime(f'2000-{value}', '%Y-%m-%d')
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'"{value}" is not a day of the year') from None
+    return value
+
+def parser(argv=None):
+    '''
+    Returns the parser arguments
+    :params: argv (list, optional) - command line arguments (default: sys.argv)
+    :return: parser.parse_args() object
+    '''
+    parser = argparse.ArgumentParser(
+        prog='telegraph-scraper',
+        description='Scrapes a telegraph pages from a specified search query'
+    )
+    main_grp = parser.add_argument_group('Main parameters')
+    main_grp.add_argument('QUERY', help = 'Single query given as a positional argument', type=str, nargs = '?')
+    main_grp.add_argument('-i', '--input-file', help = '<INPUT_FILE> text file (each query separated by new line) containing the target list. Ex: list.txt')
+    main_grp.add_argument('-o', '--output-directory', help = '<OUTPUT_DIRECTORY> (optional): query output directory (default "./Scraper results/")',
+                          default='Scraper results')
+    main_grp.add_argument('-w', '--workers', help = '<WORKERS> (optional): number of parallel execution workers (default 4)', type=int, default = 4)
+    main_grp.add_argument('-p', '--processes', help = '<PROCESSES> (optional): number of queries from <INPUT_FILE> processed in parallel, '
+                          'each with its own <WORKERS> (default 1)', type=int, default = 1)
+    main_grp.add_argument('-e', '--engine', help = '<ENGINE> (optional): indexing engine, "thread" or "async" (default "thread"). '
+                          'With "async" <WORKERS> is the number of concurrent requests', choices=['thread', 'async'], default='thread')
+    main_grp.add_argument('--per-host', help = '<PER_HOST> (optional): async engine connection limit per host (default <WORKERS>)', type=int)
+    main_grp.add_argument('--lookahead', help = '<LOOKAHEAD> (optional): async engine index probes in flight per date (default 4)', type=int, default=4)
+    mode_grp = main_grp.add_mutually_exclusive_group()
+    mode_grp.add_argument('-s', '--stream', action='store_true', help = 'filter, fetch and write pages in one streaming pass '
+                          'with flat memory use instead of running every stage over the whole page list')
+    mode_grp.add_argument('-S', '--schedule', action='store_true', help = 'overlap indexing, content fetching, image downloads and writes '
+                          'on one prioritized scheduler sharing <WORKERS> threads')
+    main_grp.add_argument('--max-pending', help = '<MAX_PENDING> (optional): pages in flight before --schedule holds back content fetches and index probes (default 1000)',
+                          type=int, default=1000)
+    main_grp.add_argument('--miss-ttl', help = '<MISS_TTL> (optional): hours to skip dates whose next page was missing on the last run (default 0, off)',
+                          type=float, default=0)
+    main_grp.add_argument('--miss-decay', help = '<MISS_DECAY> (optional): extra <MISS_TTL> per day since the date last occurred, a miss never outlives '
+                          'the day before the date comes round again (default 0)',
+                          type=float, default=0)
+    main_grp.add_argument('--rate', help = '<RATE> (optional): maximum API requests per second (default unlimited)', type=float)
+    main_grp.add_argument('--max-attempts', help = '<MAX_ATTEMPTS> (optional): attempts per API request before giving up (default 5)', type=int, default=5)
+
+    daemon_grp = parser.add_argument_group('Daemon parameters')
+    daemon_grp.add_argument('--socket', help = '<SOCKET> (optional): run the query in a "telegraph-scraper serve" daemon listening on '
+                            'this Unix socket instead of starting a new scraper')
+
+    metrics_grp = parser.add_argument_group('Metrics parameters')
+    metrics_grp.add_argument('--metrics-file', help = '<METRICS_FILE> (optional): write counters, latency histograms and stage timings as JSON')
+    metrics_grp.add_argument('--prometheus-file', help = '<PROMETHEUS_FILE> (optional): write metrics in the Prometheus textfile format')
+    metrics_grp.add_argument('--prometheus-port', help = '<PROMETHEUS_PORT> (optional): serve metrics on http://127.0.0.1:<PORT>/metrics while running', type=int)
+
+    output_grp = parser.add_argument_group('Output parameters')
+    output_grp.add_argument('-I', '--images', action='store_true', help = 'collect all images on indexed pages')
+    output_grp.add_argument('--revalidate', action='store_true', help = 're-check already downloaded images with conditional requests')
+    output_grp.add_argument('--max-bytes', help = '<MAX_BYTES> (optional): megabytes of image downloads in flight at once (default 64)',
+                            type=float, default=64)
+    output_grp.add_argument('--max-bandwidth', help = '<MAX_BANDWIDTH> (optional): megabytes per second all image downloads '
+                            'may receive together (default unlimited)', type=float)
+    output_grp.add_argument('-T', '--text', action='store_true', help='collect all text on indexed pages')
+    output_grp.add_argument('-L', '--links', action='store_true', help = 'collect all links on indexed pages')
+    output_grp.add_argument('-x', '--export', help = '<EXPORT> (optional): write path, url, title, author, views, text, links and images '
+                            'of all pages into one compressed file per query instead of per-page text and links files', choices=FORMATS)
+    output_grp.add_argument('-max', help='<MAX> (optional): Filter pages with text length greater than defined value.', type=int, nargs='?')
+    output_grp.add_argument('-min', help='<MIN> (optional): Filter pages with text length less than defined value.', type=int, nargs='?')
+
+    filter_grp = parser.add_argument_group('Filter parameters')
+    filter_grp.add_argument('--no-spam-filter', action='store_true', help = 'keep pages by authors in the spam list')
+    filter_grp.add_argument('--title', help = '<TITLE> (optional): keep pages whose title matches a regular expression (case-insensitive)')
+    filter_grp.add_argument('--date-from', help = '<DATE_FROM> (optional): keep pages published on or after MM-DD', type=monthDay)
+    filter_grp.add_argument('--date-to', help = '<DATE_TO> (optional): keep pages published on or before MM-DD, wraps around the new year '
+                            'when earlier than <DATE_FROM>', type=monthDay)
+    filter_grp.add_argument('--min-views', help = '<MIN_VIEWS> (optional): keep pages with at least this many views', type=int)
+    filter_grp.add_argument('--min-images', help = '<MIN_IMAGES> (optional): keep pages with at least this many images', type=int)
+    filter_grp.add_argument('-D', '--dedup', action='store_true', help = 'drop near-duplicate pages (same text and images under '
+                            'other slugs or authors), keeping the first copy seen in any query')
+    filter_grp.add_argument('--dedup-threshold', help = '<DEDUP_THRESHOLD> (optional): share of text shingles and images two pages '
+                            'must have in common to count as duplicates, 0-1 (default 0.7)', type=float, default=0.7)
+    filter_grp.add_argument('--max-images', help = '<MAX_IMAGES> (optional): keep pages with at most this many images', type=int)
+
+    return parser.parse_args(argv)
+
+def deleteEmptyFolders(directory):
+    '''
+    Recursively delete empty folders starting from the given directory.
+    :params: The directory to start searching for empty folders.
+    :return: none
+    '''
+    logging.info(f'Deleting empty folders...')
+
+    for root, dirs, files in os.walk(directory, topdown=False):
+        for dir_name in dirs:
+            folder_path = os.path.join(root, dir_name)
+            if not os.listdir(folder_path):
+                os.rmdir(folder_path)
+
+def buildFilters(args, scraper):
+    '''
+    Builds the filter pipeline selected on the command line
+    :params: args (argparse.Namespace) - parsed CLI arguments; scraper (Scraper) - provides page extraction
+    :return: (metadata filters, content filters) lists of (name, predicate) pairs; content filters need page content
+    '''
+    metadata = []
+    if not args.no_spam_filter:
+        metadata.append(('spam', spamAuthors(extra.spam)))
+    if args.date_from or args.date_to:
+        metadata.append(('date', dateWindow(args.date_from, args.date_to)))
+    if args.min_views is not None:
+        metadata.append(('views', minViews(args.min_views)))
+    if args.title:
+        metadata.append(('title', titleMatches(args.title)))
+
+    content = []
+    if args.min is not None or args.max is not None:
+        content.append(('length', textLength(scraper.extractPage, args.min, args.max)))
+    if args.min_images is not None or args.max_images is not None:
+        content.append(('images', imageCount(scraper.extractPage, args.min_images, args.max_images)))
+    if args.dedup:
+        # last, so pages dropped by other filters never become the kept copy
+        content.append(('duplicate', nearDuplicates(scraper.extractPage, scraper.getFingerprints(),
+                                                    scraper.formated_query, args.dedup_threshold)))
+    return metadata, content
+
+def runQuery(query, args, progress=True):
+    '''
+    Runs the whole scraping pipeline for a single query
+    :params: query (str) - search query; args (argparse.Namespace) - parsed CLI arguments; progress (bool) - show progress bars
+    :return: dict summary of the query run
+    '''
+    from .transport import Transport
+
+    started = time.monotonic()
+    limiter = RateLimiter(rate=args.rate, max_attempts=args.max_attempts)
+    scraper = Scraper(query, args.output_directory, progress, limiter, Transport.shared(args.workers))
+    scraper.getCache()
+    metadata_filters, content_filters = buildFilters(args, scraper)
+    # image budgets are given in megabytes
+    max_bytes = int(args.max_bytes * 1024 * 1024)
+    max_bandwidth = args.max_bandwidth * 1024 * 1024 if args.max_bandwidth else None
+
+    if not args.schedule:
+        scraper.indexQuery(args.workers, args.engine, args.per_host, args.lookahead, content=False,
+                           miss_ttl=args.miss_ttl * 3600, miss_decay=args.miss_decay)
+        scraper.updateCache()
+
+    if args.schedule:
+        # indexing is one of the scheduled stages
+        scraper.scheduleQuery(args.workers, metadata_filters, content_filters, args.images, args.text, args.links,
+                              max_bytes=max_bytes, max_bandwidth=max_bandwidth, revalidate=args.revalidate,
+                              export=args.export, max_pending=args.max_pending,
+                              miss_ttl=args.miss_ttl * 3600, miss_decay=args.miss_decay)
+        scraper.updateCache()
+    elif args.stream:
+        scraper.streamQuery(args.workers, metadata_filters, content_filters, args.images, args.text, args.links,
+                            max_bytes=max_bytes, max_bandwidth=max_bandwidth, revalidate=args.revalidate,
+                            export=args.export)
+    else:
+        scraper.filterPages(metadata_filters)
+
+        if content_filters or args.images or args.text or args.links or args.export:
+            scraper.fetchContent(args.workers)
+
+        scraper.filterPages(content_filters)
+
+        if args.images:
+            scraper.getImages(args.workers, max_bytes, max_bandwidth, args.revalidate)
+
+        if args.export:
+            scraper.exportPages(args.export)
+        else:
+            if args.text:
+                scraper.getText()
+
+            if args.links:
+                scraper.getLinks()
+
+            if not (args.images or args.text or args.links):
+                scraper.getPagesUrl()
+
+    scraper.cache.close()
+    if scraper.fingerprints is not None:
+        scraper.fingerprints.close()
+    return {
+        'query': query,
+        'pages': len(scraper.pagelist),
+        'seconds': round(time.monotonic() - started, 2),
+    }
+
+def runPooledQuery(query, args):
+    '''
+    Runs a query in a pool process and attaches the metrics it produced
+    :params: query (str) - search query; args (argparse.Namespace) - parsed CLI arguments
+    :return: dict summary of the query run with a 'metrics' snapshot
+    '''
+    setupLogging()
+    metrics.reset()
+    result = runQuery(query, args, False)
+    result['metrics'] = metrics.snapshot()
+    return result
+
+def runBatch(input_list, args):
+    '''
+    Runs queries in parallel across a pool of processes, each with its own <WORKERS> budget
+    :params: input_list (list) - search queries; args (argparse.Namespace) - parsed CLI arguments
+    :return: list of dict summaries, one per query
+    '''
+    summary = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.processes) as executor:
+        futures = {executor.submit(runPooledQuery, query, args): query for query in input_list}
+        for future in progressBar(concurrent.futures.as_completed(futures), total=len(futures), desc='Processing queries', unit=' query'):
+            try:
+                result = future.result()
+                metrics.merge(result.pop('metrics'))
+                summary.append(result)
+            except Exception as ex:
+                logging.error(f'Error while processing query "{futures[future]}": {ex}')
+                summary.append({'query': futures[future], 'error': str(ex)})
+    return summary
+
+def printSummary(summary):
+    '''
+    Prints and logs a merged summary of all processed queries
+    :params: summary (list) - dict summaries returned by runQuery
+    :return: none
+    '''
+    failed = [item['query'] for item in summary if 'error' in item]
+    pages = sum(item.get('pages', 0) for item in summary)
+    connections = metrics.value('http_connections_total')
+    message = (f'Processed {len(summary)} queries: {pages} pages, {len(failed)} failed, '
+               f'{connections:g} HTTP connections for {metrics.value("http_requests_total"):g} requests')
+    logging.info(message)
+    print(message)
+    for query in failed:
+        print(f'  failed: {query}')
+
+def runArgs(args, progress=True):
+    '''
+    Runs every query selected on the command line and writes the requested metrics
+    :params: args (argparse.Namespace) - parsed CLI arguments; progress (bool) - show progress bars
+    :return: none
+    '''
+    if args.input_file != None:
+        with open(args.input_file,'rb') as file:
+            try:
+                input_list = [l.decode('utf-8').strip() for l in file.readlines() if l.strip()]
+            
+            except UnicodeDecodeError as e:
+                print('Your input file is not UTF-8 encoded, please encode it before using this script')
+                return
+    else:
+        input_list = [args.QUERY]
+
+    args.output_directory = os.path.abspath(args.output_directory)
+    if not os.path.exists(args.output_directory):
+        os.makedirs(args.output_directory)
+
+    if args.prometheus_port:
+        metrics.serve(args.prometheus_port)
+
+    if args.processes > 1 and len(input_list) > 1:
+        printSummary(runBatch(input_list, args))
+    else:
+        summary = [runQuery(query, args, progress) for query in input_list]
+        if len(summary) > 1:
+            printSummary(summary)
+    
+    deleteEmptyFolders(args.output_directory)
+
+    if args.metrics_file:
+        metrics.writeJSON(args.metrics_file)
+    if args.prometheus_file:
+        metrics.writePrometheus(args.prometheus_file)
+
+    logging.info(f'Done')
+
+def main(argv=None):
+    args = parser(argv)
+    if args.socket:
+        from .daemon import request
+        return request(args.socket, sys.argv[1:] if argv is None else argv)
+
+    setupLogging()
+    runArgs(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
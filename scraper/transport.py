@@ -0,0 +1,163 @@
+import os
+import socket
+import threading
+import time
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from .metrics import metrics
+
+DNS_TTL = 300
+
+
+class DNSCache(object):
+    '''
+    Thread-safe cache of resolved host addresses, so new connections to the same hosts
+    skip the resolver until the entry expires
+    '''
+    def __init__(self, ttl=DNS_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def resolve(self, host, port):
+        '''
+        Returns a cached address of a host, resolving it on a miss
+        :params: host (str) - host name; port (int) - port used for the lookup
+        :return: address string, or the host itself if it is an IP address or cannot be resolved
+        '''
+        key = (host, port)
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            metrics.inc('cache_lookups_total', cache='dns', result='hit')
+            return entry[0]
+
+        metrics.inc('cache_lookups_total', cache='dns', result='miss')
+        try:
+            address = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0][4][0]
+        except (OSError, IndexError):
+            # let the connection raise the usual resolution error
+            return host
+        with self.lock:
+            self.entries[key] = (address, time.monotonic() + self.ttl)
+        return address
+
+
+dns = DNSCache()
+
+
+def openConnection(connection, connect):
+    '''
+    Connects a pooled connection to the cached address of its host and counts the handshake. Runs for new
+    connections and for pooled ones reconnecting after the server closed them. The host name is kept for
+    the Host header, SNI and certificate checks
+    :params: connection (HTTPConnection) - the connection; connect (callable) - the connect method of its base class
+    :return: none
+    '''
+    host = connection._dns_host
+    if connection._tunnel_host is None and not isIpAddress(host):
+        if getattr(connection, 'server_hostname', False) is None:
+            connection.server_hostname = host
+        connection._dns_host = dns.resolve(host, connection.port)
+    try:
+        connect()
+    finally:
+        connection._dns_host = host
+    metrics.inc('http_connections_total', host=host)
+
+
+class CountingHTTPConnection(HTTPConnection):
+    def connect(self):
+        openConnection(self, super().connect)
+
+
+class CountingHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        openConnection(self, super().connect)
+
+
+class CountingHTTPPool(HTTPConnectionPool):
+    ConnectionCls = CountingHTTPConnection
+
+
+class CountingHTTPSPool(HTTPSConnectionPool):
+    ConnectionCls = CountingHTTPSConnection
+
+
+class CountingAdapter(HTTPAdapter):
+    '''
+    HTTPAdapter whose pools resolve hosts through the DNS cache and count opened connections and requests
+    '''
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': CountingHTTPPool, 'https': CountingHTTPSPool}
+
+    def send(self, request, *args, **kwargs):
+        metrics.inc('http_requests_total', host=urlparse(request.url).hostname)
+        return super().send(request, *args, **kwargs)
+
+
+class Transport(object):
+    '''
+    Process-wide HTTP transport shared by every Scraper and every stage: one requests session whose
+    keep-alive pools hold as many connections per host as the configured concurrency
+    '''
+    _shared = None
+    _shared_pid = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, pool_size=10):
+        self.session = requests.Session()
+        self.lock = threading.Lock()
+        self.pool_size = 0
+        self.resize(pool_size)
+
+    @classmethod
+    def shared(cls, pool_size=None):
+        '''
+        Returns the transport of the current process, creating it on first use.
+        A forked process gets its own transport instead of the sockets of its parent
+        :params: pool_size (int, optional) - grow the pools to at least this many connections per host
+        :return: Transport
+        '''
+        with cls._shared_lock:
+            if cls._shared is None or cls._shared_pid != os.getpid():
+                cls._shared = cls(pool_size or 10)
+                cls._shared_pid = os.getpid()
+            elif pool_size:
+                cls._shared.resize(pool_size)
+            return cls._shared
+
+    def resize(self, pool_size):
+        '''
+        Grows the connection pools to at least `pool_size` connections per host.
+        Pools are only replaced when they grow, so warm connections survive later calls
+        :params: pool_size (int) - connections per host
+        :return: none
+        '''
+        with self.lock:
+            if pool_size <= self.pool_size:
+                return
+            self.pool_size = pool_size
+            previous = self.session.get_adapter('http://')
+            adapter = CountingAdapter(pool_connections=8, pool_maxsize=pool_size)
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+            # closes the idle sockets of the old pools, connections still in use are closed when released
+            previous.close()
+
+
+def isIpAddress(host):
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            socket.inet_pton(family, host.strip('[]'))
+            return True
+        except (OSError, ValueError):
+            continue
+    return False
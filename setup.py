@@ -13,9 +13,15 @@ setup(
         "tqdm",
         "requests"
     ],
+    extras_require={
+        "async": ["aiohttp"],
+        "zstd": ["zstandard"],
+        "parquet": ["pyarrow"],
+    },
     entry_points={
         'console_scripts': [
             'telegraph-scraper = scraper:main',
+            'telegraph-scraper-bench = scraper.bench.scenarios:main',
         ],
     },
     keywords="telegraph scrape image images download",